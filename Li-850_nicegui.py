@@ -1,472 +1,576 @@
-from nicegui import ui, app
-import serial
-import time
-import serial.tools.list_ports
-import threading
-import re
-import pandas as pd
+from nicegui import ui, app, run, background_tasks
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+from hardware import SharedHardware, PENDING, MISSING
+from device_manager import DeviceManager
+from li850_client import read_filenames
+from plot_stream import PlotStream
+from flux import DEFAULT_VOLUME, DEFAULT_AREA, DEFAULT_DEAD_BAND
+from network_status import NetworkStatus
+from session_store import export_csv
+from session_catalog import SessionCatalog
+from sample_bus import SampleBus
+from metrics import Metrics, EventLoopLag, latency_samples
+from sync_service import SyncService
+from scheduler import CollarScheduler, read_schedule, DEFAULT_DURATION
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont
-import adafruit_ssd1306
-import subprocess
-import socket
-
-class Li_850_client():
-    def __init__(self, port=None, baudrate=9600,timeout=1):
-        self.port = port
-        self.baudrate = baudrate
-        self.timeout = timeout
-        self.serial_connection = None
-        self.is_reading = False
-        self.read_thread = None
-        self.new_dataframe = True
-        self.data_frame = None
-        self.filename = None
-        self.filename_exists = False
-        self.recording = False
-        self.CO2_conc = None
-        self.is_connected = False
-        self.user = "None"
-        self.sensor = False
-        self.oled = False
-	
-        try:
-            import board
-            self.i2c = board.I2C()
-        except Exception as e:
-            print(e)
-        
-        try:
-            import adafruit_sht4x
-            self.sht = adafruit_sht4x.SHT4x(self.i2c)
-            print("Found SHT4x with serial number", hex(self.sht.serial_number))
-            self.sht.mode = adafruit_sht4x.Mode.NOHEAT_HIGHPRECISION
-            self.sensor = True
-        except Exception as e:
-            print(e)
-            self.sensor = False
-        
-        try:
-            self.disp = adafruit_ssd1306.SSD1306_I2C(128, 64, self.i2c)
-            self.disp.fill(50)
-            self.disp.show()
-            # Create blank image for drawing.
-            # Make sure to create image with mode '1' for 1-bit color.
-            self.oled_width = self.disp.width
-            self.oled_height = self.disp.height
-            self.image = Image.new("1", (self.oled_width, self.oled_height))
-            # Get drawing object to draw on image.
-            self.draw = ImageDraw.Draw(self.image)
-            # Draw a black filled box to clear the image.
-            #self.draw.rectangle((0, 0, self.oled_width, self.oled_height), outline=100, fill=255)
-           
-            # Load default font.
-            self.disp.fill(0)
-            self.oled_font = ImageFont.load_default()
-            self.draw.text((2,10), text = "Loading...",font = self.oled_font,fill=255)
-            self.disp.image(self.image)
-            self.disp.show()
-            self.oled = True
-            print("Oled screen successful")
-
-        except Exception as e:
-            self.oled = False
-            print(e)
-			
-        self.ip_adress = "Not connected"
-        self.ssid = "Not connected"
-		
-    def get_ssid(self):
-        """Get the current WiFi SSID"""
-        try:
-            # Try using iwgetid command
-            result = subprocess.check_output(['iwgetid', '-r'], stderr=subprocess.DEVNULL)
-            self.ssid = result.decode('utf-8').strip()
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            self.ssid = "Not Connected"
-	
-    def get_ip(self):
-        """Get the local IP address"""
-        try:
-            # Create a socket connection to determine the local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # Connect to an external address (doesn't actually send data)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            self.ip_adress = local_ip
-        except Exception:
-            self.ip_adress = "No Connection"
-    
-    def list_available_ports(self):
-        """List all available serial ports"""
-        ports = serial.tools.list_ports.comports()
-        available_ports = []
-        for port in ports:
-            available_ports.append({'device': port.device,'name': port.name,'description': port.description})
-        return available_ports
-    
-    def list_available_ports_in_list(self):
-        """List all available serial ports"""
-        ports = serial.tools.list_ports.comports()
-        available_ports = []
-        for port in ports:
-            if "/dev/ttyS" not in port.device:
-                available_ports.append(port.device)
-        return available_ports
-
-    def read_filenames(self):
-        try:
-            with open("config_filenames.ini","r") as f:
-                filename_list = [line.strip() for line in f.readlines()]
-        except:
-            filename_list = []
-            print("No filename config file found")
-        return filename_list
-    
-    def connect(self, port=None):
-        if port:
-            self.port = port
-        if not self.port:
-            raise ValueError("No port specified in this function or init")
-        try:
-            self.serial_connection = serial.Serial(port=self.port,baudrate=self.baudrate,timeout=self.timeout)
-            print(f"Connected to {self.port} at {self.baudrate} baud")
-            self.is_connected = True
-            return True
-        except serial.SerialException as e:
-            print(f"Failed to connect to {self.port}: {e}")
-            return False
-
-    def read_line(self):
-        if not self.serial_connection or not self.serial_connection.is_open:
-            print("Serial port not connected")
-            return None
+import time
+
+PLOT_MAX_POINTS = 500
+PLOT_REFRESH_INTERVAL = 1.0
+MAX_DEVICES = 3
+
+hardware = SharedHardware(sensor_interval=1.0)
+sample_bus = SampleBus()
+devices = DeviceManager(air_sampler=None, max_devices=MAX_DEVICES, baudrate=9600, timeout=1, bus=sample_bus)
+network_status = NetworkStatus(ttl=60.0, check_interval=2.0)
+network_status.start()
+os.makedirs("data", exist_ok=True)
+catalog = SessionCatalog("data/sessions.sqlite")
+panels = []
+metrics = Metrics()
+loop_lag = EventLoopLag(interval=0.5)
+# Upload of the completed sessions, enabled by setting the collection server url
+SYNC_URL = os.environ.get("LI850_SYNC_URL")
+sync_service = SyncService(SYNC_URL, data_dir="data", is_busy=devices.any_recording, active_paths=devices.active_paths,
+                           rate=int(os.environ.get("LI850_SYNC_RATE", 50_000))) if SYNC_URL else None
+
+class DevicePanel():
+    """Connection, measurement and plot widgets driving one Li_850_client"""
+    def __init__(self, reader, number):
+        self.reader = reader
+        self.plot_stream = PlotStream(max_points=PLOT_MAX_POINTS)
+        with ui.card().classes('w-full') as self.card:
+            ui.label(f"Analyzer {number}").style('color: #444; font-weight: bold; font-size: 2rem')
+            with ui.expansion('Connection').style('color: #888; font-weight: bold; font-size: 2rem') as self.connect_expansion:
+                with ui.card():
+                    ui.label("The ports should be:").style('color: #888; font-size: 0.75rem')
+                    ui.label(" - On linux: /dev/ttyACM...     - On Windows: COM...").style('color: #888; font-size: 0.75rem')
+                    with ui.row():
+                        self.port_select = ui.select(options=reader.list_available_ports_in_list(), with_input=True)
+                        ui.button("Refresh available ports",on_click=self.refresh_ports)
+                    with ui.row():
+                        self.connect_button = ui.button("Connect to Li-850",on_click=self.connect_device)
+                        self.disconnect_button = ui.button("Disconnect",on_click=self.disconnect_device)
+                    with ui.row():
+                        self.connection_label = ui.label("Not Connected").style('color: #888; font-weight: bold; font-size: 1.2rem')
+                    self.CO2_label = ui.label("").style('color: #099427; font-weight: bold; font-size: 1.5rem')
+
+            with ui.expansion('Measurement').style('color: #888; font-weight: bold; font-size: 2rem') as self.measure_expansion:
+                with ui.card():
+                    ui.markdown('''
+                    **First**: you need to either select a filename from a list or create a new filename  
+                    **Second**: when you are ready to lock the chamber on the collar click start measurement  
+                    **Third**: Once the measurement is finished click on stop measurement and the file will be downloaded to your phone
+                    ''').style('color: #000000; font-weight: normal; font-size: 1rem')
+                    with ui.row():
+                        self.filename_select = ui.select(reader.read_filenames(),with_input = True)
+                        ui.button("Use selected filename",on_click = self.select_filename)
+                    with ui.row():
+                        self.filename_input = ui.input('Or enter new filename', placeholder='filename').props("size=30").style('background-color: #f8f8f8;font-size: 1.2rem')
+                        ui.button('Save new filename', on_click=self.get_values)
+                    self.filename_label = ui.label('No filename yet').style('color: #888; font-weight: bold; font-size: 1.5rem')
+                    with ui.row():
+                        self.volume_input = ui.number('Chamber volume (L)', value=DEFAULT_VOLUME, min=0, on_change=self.update_chamber)
+                        self.area_input = ui.number('Collar area (cm²)', value=DEFAULT_AREA, min=0, on_change=self.update_chamber)
+                        self.dead_band_input = ui.number('Dead band (s)', value=DEFAULT_DEAD_BAND, min=0, on_change=self.update_chamber)
+                    with ui.row():
+                        self.start_button = ui.button("Start Measurement", on_click=self.start_reading, color = '#099427', icon='start').style("color:black")
+                        self.stop_button = ui.button("Stop Measurement", on_click=self.stop_reading, color  ='#910617', icon='stop').style("color:black")
+                        ui.button('Download data file', on_click=self.download)
+                    self.flux_label = ui.label("").style('color: #099427; font-weight: bold; font-size: 1.5rem')
+
+            with ui.expansion('Automatic survey').style('color: #888; font-weight: bold; font-size: 2rem') as self.survey_expansion:
+                with ui.card():
+                    ui.markdown('''
+                    The collars are measured in order: the recording starts when the chamber is closed on the collar  
+                    (CO2 rising) and stops after the duration, the next collar is selected when the chamber is opened.  
+                    A line of config_filenames.ini can set the duration and dead band of a collar: `B1N10, 180, 30`
+                    ''').style('color: #000000; font-weight: normal; font-size: 1rem')
+                    self.survey_collars = ui.select([collar.name for collar in read_schedule()], multiple=True,
+                                                    label='Collars (all if none selected)').classes('w-64')
+                    with ui.row():
+                        self.survey_duration_input = ui.number('Duration (s)', value=DEFAULT_DURATION, min=10)
+                        self.close_slope_input = ui.number('Closure rise (ppm/s)', value=0.1, min=0.01, step=0.05)
+                    with ui.row():
+                        self.survey_start_button = ui.button("Start survey", on_click=self.start_survey, color='#099427').style("color:black")
+                        self.survey_stop_button = ui.button("Stop survey", on_click=self.stop_survey, color='#910617').style("color:black")
+                    self.survey_label = ui.label("").style('color: #099427; font-weight: bold; font-size: 1.5rem')
+                    self.survey_table = ui.table(columns=[
+                        {'name': 'collar', 'label': 'Collar', 'field': 'collar'},
+                        {'name': 'wait', 'label': 'Wait (s)', 'field': 'wait'},
+                        {'name': 'recorded', 'label': 'Recorded (s)', 'field': 'recorded'},
+                        {'name': 'open_delay', 'label': 'Opening (s)', 'field': 'open_delay'},
+                        {'name': 'turnaround', 'label': 'Turnaround (s)', 'field': 'turnaround'},
+                    ], rows=[], row_key='collar')
+            self.line_plot = ui.plotly({'data': [{'x': [0],'y': [0],'type': 'scatter','mode': 'lines+markers','name': 'data'}],
+                                        'layout': {'title': f'Real time data analyzer {number}','xaxis': {'title':{'text':'Time (s)'} },
+                                                   'yaxis': {'title':{'text':'CO2 concentration (ppm)'} }}})
+
+        self.disconnect_button.enabled = False
+        self.start_button.enabled = False
+        self.stop_button.enabled = False
+        self.survey_stop_button.enabled = False
+        self.connect_button.enabled = reader.user != "None"
+        self.scheduler = None
+        self.survey_subscriber = None
+
+        self.value_updates = ui.timer(5, self.update_CO2_value, active=False)
+        self.line_updates = ui.timer(PLOT_REFRESH_INTERVAL, self.update_line_plot, active=False)
+
+    async def connect_device(self):
+        print(self.port_select.value)
+        if self.port_select.value is not None:
+            if devices.port_in_use(self.port_select.value, self.reader):
+                self.connection_label.set_text(self.port_select.value+" is already used by another analyzer")
+                return
+            self.connect_button.enabled = False
+            self.connection_label.set_text("Connecting to "+self.port_select.value+"...")
+            # The analyzer configuration waits for its replies, outside of the event loop
+            await run.io_bound(devices.connect, self.reader, self.port_select.value)
+            self.connect_button.enabled = True
+            if self.reader.is_connected:
+                self.reader.start_continuous_reading()
+                self.connect_button.enabled = False
+                self.disconnect_button.enabled = True
+                self.connection_label.set_text("Is connected to "+self.port_select.value)
+                self.value_updates.active = True
+                if self.reader.filename_exists == True:
+                    self.start_button.enabled = True
+                else:
+                    self.start_button.enabled = False
+                self.measure_expansion.open()
+            else:
+                self.connection_label.set_text("Unable to connect to port "+self.port_select.value+", try again")
+        else:
+            self.connection_label.set_text("No port selected, try again")
+
+    async def disconnect_device(self):
+        self.start_button.enabled = False
+        self.disconnect_button.enabled = False
+        self.CO2_label.set_text("")
+        # Restoring the analyzer settings waits for its replies, outside of the event loop
+        await run.io_bound(self.reader.disconnect)
+        self.disconnect_button.text = "Disconnect"
+        self.connect_button.enabled = True
+        self.line_updates.active = False
+        self.connection_label.set_text("Not connected")
+
+    def start_reading(self):
+        self.reader.start_recording()
+        self.disconnect_button.enabled = False
+        self.CO2_label.set_text("")
+        self.value_updates.active  =False
+        self.connect_button.enabled = False
+        self.start_button.enabled = False
+        self.line_updates.active = True
+        self.stop_button.enabled = True
+        user_save_button.enabled = False
+        self.reader.start_continuous_reading()
+        self.connect_expansion.close()
+
+    async def stop_reading(self):
+        self.reader.recording = False
+        self.stop_button.enabled = False
+        # Joining the reader waits up to the serial timeout, outside of the event loop
+        await run.io_bound(self.reader.stop_reading)
+        self.disconnect_button.enabled = True
+        self.connect_button.enabled = False
+        self.start_button.enabled = True
+        user_save_button.enabled = not devices.any_recording()
+        if self.reader.session_samples:
+            catalog.add(self.reader.session_summary())
+        self.download()
+        self.reader.update_full_filename()
+        self.filename_label.text = "Filename updated for next: "+ self.reader.full_filename
+        self.connect_expansion.open()
+
+    def start_survey(self):
+        if not self.reader.is_connected:
+            self.survey_label.set_text("Connect the analyzer first")
+            return
+        if self.reader.recording:
+            self.survey_label.set_text("Stop the current measurement first")
+            return
+        collars = read_schedule(duration=self.survey_duration_input.value or DEFAULT_DURATION,
+                                dead_band=self.dead_band_input.value or DEFAULT_DEAD_BAND)
+        if self.survey_collars.value:
+            collars = [collar for collar in collars if collar.name in self.survey_collars.value]
+        if not collars:
+            self.survey_label.set_text("No collar in config_filenames.ini")
+            return
+        self.scheduler = CollarScheduler(collars, close_slope=self.close_slope_input.value or 0.1)
+        self.survey_table.rows = []
+        self.survey_table.update()
+        self.survey_start_button.enabled = False
+        self.survey_stop_button.enabled = True
+        self.start_button.enabled = False
+        self.stop_button.enabled = False
+        self.disconnect_button.enabled = False
+        user_save_button.enabled = False
+        # The CO2 trend is followed between the recordings too
+        self.reader.start_continuous_reading()
+        self.value_updates.active = True
+        self.survey_subscriber = sample_bus.subscribe(maxsize=100, topic=self.reader.port)
+        background_tasks.create(self.run_survey(self.scheduler, self.survey_subscriber))
+
+    async def stop_survey(self):
+        if self.scheduler is not None:
+            self.survey_stop_button.enabled = False
+            await self.apply_survey_actions(self.scheduler.stop())
+            self.survey_label.set_text("Survey stopped")
+        if self.survey_subscriber is not None:
+            # run_survey may wait for a sample that never comes if the reader stopped
+            self.survey_subscriber.close()
+        self.survey_finished()
+
+    async def run_survey(self, scheduler, subscriber):
+        """Feeds the live samples of the analyzer to the scheduler until the survey is done or stopped"""
         try:
-            if self.serial_connection.in_waiting > 0:
-                line = self.serial_connection.readline().decode('utf-8').strip()
-                return line
-        except Exception as e:
-            print(f"Error reading from serial port: {e}")
-        return None
-    
-    def stop_recording(self):
-        self.recording = False
-    
-    def disconnect(self):
-        """Disconnect from the serial port"""
-        self.stop_reading()
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
-            print(f"Disconnected from {self.port}")
-        self.CO2_conc = None
-        self.is_connected = False
-
-    def _continuous_read(self):
-        """Internal method for continuous reading in a separate thread"""
-        while self.is_reading and self.serial_connection and self.serial_connection.is_open:
-            try:
-                if self.serial_connection.in_waiting > 0:
-                    line = self.serial_connection.readline().decode('utf-8').strip()
-                    if line:
-                        #print(f"Received: {line}")
-                        self.CO2_conc = self.extract_co2_h2o(line)[0]
-                        if self.recording:
-                            self.save_data_in_dataframe(values = self.extract_co2_h2o(line), finished = False)
-                time.sleep(0.1)  # Small delay to prevent excessive CPU usage
-            except Exception as e:
-                print(f"Error in continuous read: {e}")
-                break
-    
-    def start_continuous_reading(self):
-        """Start reading continuously in a separate thread"""
-        if not self.serial_connection or not self.serial_connection.is_open:
-            print("Serial port not connected")
-            return False
-            
-        if self.is_reading:
-            print("Already reading continuously")
-            return False 
-        self.is_reading = True
-        self.serial_connection.reset_input_buffer() # flush the serial input to avoid getting any old values
-        self.read_thread = threading.Thread(target=self._continuous_read, daemon=True)
-        self.read_thread.start()
-        print("Started continuous reading")
-        return True
-    
-    def update_full_filename(self):
-        now = datetime.now()
-        datetime_string = f"_{now.year:04d}_{now.month:02d}_{now.day:02d}_{now.hour:02d}_{now.minute:02d}.csv"
-        self.full_filename = self.filename+datetime_string
-
-    def stop_reading(self):
-        """Stop continuous reading"""
-        if self.is_reading:
-            self.is_reading = False
-            if self.read_thread:
-                self.read_thread.join(timeout=10000)
-            self.save_data_in_dataframe(finished = True)
-            print("Stopped continuous reading")
-    
-    def extract_co2_h2o(self,xml_data):
-        """
-        Extract CO2 and H2O values from XML data, excluding those inside <raw> tags.
-        
-        Args:
-            xml_data (str): XML string containing sensor data
-            
-        Returns:
-            tuple: (co2_value, h2o_value) as floats
-        """
-        # Remove the <raw>...</raw> section to avoid extracting values from it
-        cleaned_data = re.sub(r'<raw>.*?</raw>', '', xml_data, flags=re.DOTALL)
-        
-        # Extract CO2 value
-        co2_match = re.search(r'<co2>(.*?)</co2>', cleaned_data)
-        co2_value = float(co2_match.group(1)) if co2_match else None
-        
-        # Extract H2O value  
-        h2o_match = re.search(r'<h2o>(.*?)</h2o>', cleaned_data)
-        h2o_value = float(h2o_match.group(1)) if h2o_match else None
-
-        # Extract cell pressure
-        press_match = re.search(r'<cellpres>(.*?)</cellpres>', cleaned_data)
-        press_value = float(press_match.group(1)) if press_match else None
-
-        # Extract cell temperature
-        temp_match = re.search(r'<celltemp>(.*?)</celltemp', cleaned_data)
-        temp_value = float(temp_match.group(1)) if temp_match else None
-
-        # Extract air temp using I2C sensor
-        if self.sensor:
-            try:
-                #print(self.sht_measurements)
-                temp_air, rel_hum_air = self.sht.measurements
-            except Exception as e:
-                temp_air = 9999
-                rel_hum_air = 9999
-                print(e)
+            if subscriber.closed:
+                return
+            actions = scheduler.start()
+            await self.apply_survey_actions(actions)
+            # Once stopped, stop_survey closes the subscriber after the last recording is finished
+            while not subscriber.closed and ("done", None) not in actions:
+                for payload in await subscriber.get_batch():
+                    sample = json.loads(payload)
+                    actions = scheduler.update(sample["time"], sample["co2"])
+                    await self.apply_survey_actions(actions)
+                    if ("done", None) in actions:
+                        break
+        finally:
+            sample_bus.unsubscribe(subscriber)
+            if self.survey_subscriber is subscriber:
+                self.survey_subscriber = None
+            self.survey_finished()
+
+    def survey_finished(self):
+        self.survey_start_button.enabled = True
+        self.survey_stop_button.enabled = False
+        self.disconnect_button.enabled = True
+        self.start_button.enabled = self.reader.filename_exists
+        user_save_button.enabled = not devices.any_recording()
+
+    async def apply_survey_actions(self, actions):
+        for action, collar in actions:
+            if action == "arm":
+                self.reader.filename = collar.name
+                self.use_filename()
+                self.dead_band_input.value = collar.dead_band
+                self.start_button.enabled = False
+                self.survey_label.set_text(f"Close the chamber on {collar.name}")
+            elif action == "start":
+                # The file is named at the closure
+                self.reader.update_full_filename()
+                self.filename_label.text = "Current filename: "+ self.reader.full_filename
+                self.reader.start_recording()
+                self.line_updates.active = True
+                self.survey_label.set_text(f"Recording {collar.name} for {collar.duration:.0f} s")
+            elif action == "stop":
+                await run.io_bound(self.reader.finish_recording)
+                self.line_updates.active = False
+                self.update_line_plot()
+                if self.reader.session_samples:
+                    catalog.add(self.reader.session_summary())
+                self.survey_label.set_text(f"{collar.name} done, open the chamber")
+            elif action == "done":
+                stats = self.scheduler.stats()
+                if stats and stats["mean_turnaround"] is not None:
+                    self.survey_label.set_text(f"Survey finished: {stats['collars']} collars, "
+                                               f"mean turnaround {stats['mean_turnaround']:.0f} s")
+                else:
+                    self.survey_label.set_text("Survey finished")
+            if self.scheduler.timings and len(self.scheduler.timings) != len(self.survey_table.rows):
+                self.survey_table.rows = [{key: f"{value:.0f}" if isinstance(value, float) else (value or "")
+                                           for key, value in entry.items()} for entry in self.scheduler.timings]
+                self.survey_table.update()
+
+    def update_CO2_value(self):
+        if self.reader.is_connected:
+            if self.reader.CO2_conc is not None:
+                self.CO2_label.set_text(f"Current CO2: {self.reader.CO2_conc:.1f} ppm")
+
+    def get_values(self):
+        if self.filename_input.value is None:
+            self.reader.filename = "fake_data.csv"
         else:
-            temp_air = 9999
-            rel_hum_air=9999
-
-        return (co2_value, h2o_value, press_value, temp_value,temp_air,rel_hum_air)
-
-    def save_data_in_dataframe(self,values=None,finished = False):
-        if finished == True:
-            if self.data_frame is not None:
-                self.data_frame.to_csv("data/"+self.full_filename,index_label='rcrd_nb')
-                self.data_frame = None
-                self.filename_exists=False
-                #self.filename = None
-                self.record_number = 1
-                self.new_dataframe = True
-                return None
-            else:
-                return None
-        if values[0] is not None and values[1] is not None:
-            if self.new_dataframe:
-                self.start_time = time.time()
-                dict_values = {"elapsed_time": time.time()-self.start_time,"CO2_ppm":values[0], "H2O":values[1],
-                               "Cell_pressure":values[2],"Cell_temp":values[3],"Air_temp":values[4],
-                               "Rel_hum_air":values[5], "user":self.user}
-                self.data_frame = pd.DataFrame(dict_values,index = [0])
-                self.record_number = 1
-            else:
-                dict_values = {"elapsed_time": time.time()-self.start_time,"CO2_ppm":values[0], "H2O":values[1],
-                               "Cell_pressure":values[2],"Cell_temp":values[3],"Air_temp":values[4],
-                               "Rel_hum_air":values[5], "user":self.user}
-                self.data_frame = pd.concat([self.data_frame,pd.DataFrame(dict_values, index =[self.record_number])])
-                self.data_frame.to_csv("data/"+self.full_filename,index_label='rcrd_nb')
-                self.record_number = self.record_number+1
-            self.new_dataframe = False
-
-reader = Li_850_client(port = "/dev/ttyACM0", baudrate=9600, timeout=1)
-    
-def connect_device():
-    print(port_select.value)
-    if port_select.value is not None:
-        reader.connect(port=port_select.value)
-        if reader.is_connected:
-            reader.start_continuous_reading()
-            connect_button.enabled = False
-            disconnect_button.enabled = True
-            connection_label.set_text("Is connected to "+port_select.value)
-            value_updates.active = True
-            if reader.filename_exists == True:
-                start_button.enabled = True
-            else:
-                start_button.enabled = False
-            measure_expansion.open()
+            self.reader.filename = self.filename_input.value
+        self.use_filename()
+
+    def select_filename(self):
+        if self.filename_select.value is None:
+            self.reader.filename = "fake_data.csv"
+        else:
+            self.reader.filename = self.filename_select.value
+        self.use_filename()
+
+    def use_filename(self):
+        self.reader.filename_exists = True
+        self.reader.update_full_filename()
+        self.filename_label.text = "Current filename: "+ self.reader.full_filename
+        if self.reader.is_connected:
+            self.start_button.enabled = True
+
+    def update_flux(self):
+        result = self.reader.flux.result()
+        if result is None:
+            self.flux_label.set_text("Flux: waiting for samples after the dead band")
+        elif result["flux"] is None:
+            self.flux_label.set_text(f"Slope: {result['slope']:.3f} ppm/s (R² {result['r2']:.3f}, n={result['n']})")
         else:
-            connection_label.set_text("Unable to connect to port "+port_select.value+", try again")
-    else:
-        connection_label.set_text("No port selected, try again")
-
-def disconnect_device():
-    start_button.enabled = False
-    CO2_label.set_text("")
-    reader.disconnect()
-    disconnect_button.enabled = False
-    disconnect_button.text = "Disconnect"
-    connect_button.enabled = True
-    line_updates.active = False
-    connection_label.set_text("Not connected")
-
-def start_reading():
-    reader.recording = True
-    disconnect_button.enabled = False
-    CO2_label.set_text("")
-    value_updates.active  =False
-    #disconnect_button.text = "Disconnect and stop"
-    connect_button.enabled = False
-    start_button.enabled = False
-    line_updates.active = True
-    stop_button.enabled = True
-    user_save_button.enabled = False
-    reader.start_continuous_reading()
-    connect_expansion.close()
-    
-def stop_reading():
-    reader.recording = False
-    disconnect_button.enabled = True
-    connect_button.enabled = False
-    start_button.enabled = True
-    user_save_button.enabled = True
-    stop_button.enabled = False
-    reader.stop_reading()
-    ui.download.file("data/"+reader.full_filename)
-    reader.update_full_filename()
-    filename_label.text = "Filename updated for next: "+ reader.full_filename
-    connect_expansion.open()
-
-def update_CO2_value():
-    if reader.is_connected:
-        #print(reader.CO2_conc)
-        if reader.CO2_conc is not None:
-            CO2_label.set_text(f"Current CO2: {reader.CO2_conc:.1f} ppm")
-
-def get_values():
-    if filename_input.value is None:
-        reader.filename = "fake_data.csv"
-    else:
-        reader.filename = filename_input.value
-    reader.filename_exists = True
-    reader.update_full_filename()
-    filename_label.text = "Current filename: "+ reader.full_filename
-    if reader.is_connected:
-        start_button.enabled = True
-
-def select_filename():
-    if filename_select.value is None:
-        reader.filename = "fake_data.csv"
-    else:
-        reader.filename = filename_select.value
-    reader.filename_exists = True
-    reader.update_full_filename()
-    filename_label.text = "Current filename: "+ reader.full_filename
-    if reader.is_connected:
-        start_button.enabled = True
-
-def update_line_plot():
-    if reader.data_frame is not None:
-        line_plot.figure['data'][0]['x'] = reader.data_frame['elapsed_time'].tolist()
-        line_plot.figure['data'][0]['y'] = reader.data_frame['CO2_ppm'].tolist()
-        line_plot.update_figure(line_plot.figure)
-
-def refresh_ports():
-    port_select.set_options(reader.list_available_ports_in_list())
-
-def update_oled():
-    if reader.oled:
-        reader.get_ssid()
-        reader.get_ip()
-        reader.image = Image.new("1", (reader.oled_width, reader.oled_height))
-            # Get drawing object to draw on image.
-        reader.draw = ImageDraw.Draw(reader.image)
-            # Draw a black filled box to clear the image.
-            #self.draw.rectangle((0, 0, self.oled_width, self.oled_height), outline=100, fill=255)
-            # Load default font.
-        reader.disp.fill(0)
-        #reader.draw.text((0,0), text = "Loading...",font = self.oled_font, outline = 100,fill=255)
-        reader.draw.text((2, 2 + 0), "SSID: " + reader.ssid, font=reader.oled_font, fill=255)
-        reader.draw.text((2, 2 + 12), "IP: " + reader.ip_adress, font=reader.oled_font, fill=255)
-        reader.disp.image(reader.image)
-        reader.disp.show()
-    else:
+            self.flux_label.set_text(f"Flux: {result['flux']:.3f} µmol m⁻² s⁻¹ (R² {result['r2']:.3f}, n={result['n']})")
+
+    def update_chamber(self):
+        if self.volume_input.value:
+            self.reader.flux.volume = self.volume_input.value
+        if self.area_input.value:
+            self.reader.flux.area = self.area_input.value
+        if self.dead_band_input.value is not None:
+            self.reader.flux.dead_band = self.dead_band_input.value
+
+    def update_line_plot(self):
+        self.update_flux()
+        update = self.plot_stream.next_update(self.reader.buffer)
+        if update is None:
+            return
+        kind, x, y = update
+        x_json, y_json = json.dumps(x), json.dumps(y)
+        trace = self.line_plot.figure['data'][0]
+        if kind == "full":
+            trace['x'] = x
+            trace['y'] = y
+            self.line_plot.update_figure(self.line_plot.figure)
+            self.plot_stream.record_payload(len(x_json) + len(y_json))
+        else:
+            # Keep the server side figure current for new clients but only send the new points
+            trace['x'].extend(x)
+            trace['y'].extend(y)
+            script = f'''
+                const plot = getElement({self.line_plot.id});
+                if (plot && window.Plotly) {{
+                    Plotly.extendTraces(plot.$el, {{x: [{x_json}], y: [{y_json}]}}, [0]);
+                }} else if (plot) {{
+                    plot.options.data[0].x.push(...{x_json});
+                    plot.options.data[0].y.push(...{y_json});
+                    plot.update();
+                }}
+            '''
+            ui.run_javascript(script)
+            self.plot_stream.record_payload(len(script))
+
+    def refresh_ports(self):
+        self.port_select.set_options(self.reader.list_available_ports_in_list())
+
+    def download(self):
+        # The csv is streamed from the binary session file only when it is downloaded
+        session_path = "data/"+self.reader.full_filename
+        if os.path.exists(session_path):
+            ui.download.file(export_csv(session_path))
+
+async def update_oled():
+    if hardware.oled:
+        connected = sum(1 for client in devices.clients if client.is_connected)
+        lines = ("SSID: " + network_status.ssid, "IP: " + network_status.ip_address,
+                 f"Analyzers: {connected}/{len(devices.clients)}")
+        # Only pushed over I2C when the text changed, outside of the event loop
+        await run.io_bound(hardware.oled_renderer.render, lines)
+    elif hardware.status["oled"] == MISSING:
         print("No oled screen")
 
+async def discover_hardware():
+    # Runs once the server is up so the interface is served while the I2C devices are probed
+    await run.io_bound(hardware.discover)
+    devices.set_air_sampler(hardware.air_sampler)
+
+async def attach_sample_bus():
+    sample_bus.attach_loop(asyncio.get_running_loop())
+
+@app.get('/stream')
+async def stream_samples(port: str = None):
+    """Raw live samples as server-sent events, optionally of a single analyzer port"""
+    return StreamingResponse(sample_bus.sse(topic=port), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache'})
+
+@metrics.register
+def pipeline_metrics():
+    for client in devices.clients:
+        labels = {"port": client.port}
+        if client.frame_reader is not None:
+            frame_reader = client.frame_reader
+            yield "frames_received_total", "counter", "Frames received on the serial port", frame_reader.frames, labels
+            yield "frames_partial_total", "counter", "Frames without both li850 tags", frame_reader.partial_frames, labels
+            yield "frames_dropped_total", "counter", "Byte sequences dropped by the framing", frame_reader.dropped_frames, labels
+            yield "serial_bytes_total", "counter", "Bytes read from the serial port", frame_reader.bytes_read, labels
+            yield from latency_samples("frame_latency", "Frame arrival to sample stored", frame_reader.latency, labels)
+        yield from latency_samples("parse", "Frame parse time", client.parse_time, labels)
+        yield from latency_samples("storage_write", "Session file write time", client.recorder.write_time, labels)
+        yield "samples_recorded_total", "counter", "Samples written to session files", client.samples_recorded, labels
+        yield "samples_dropped_total", "counter", "Samples dropped because the writer queue was full", client.dropped_samples, labels
+        yield "writer_queue_depth", "gauge", "Samples waiting for the writer thread", client.sample_queue.qsize(), labels
+        yield "storage_bytes", "gauge", "Bytes written to the current session file", client.recorder.bytes_written, labels
+        yield "storage_syncs", "gauge", "fsync calls on the current session file", client.recorder.syncs, labels
+        yield "recording", "gauge", "1 while recording", int(client.recording), labels
+        yield "output_configured", "gauge", "1 if the analyzer acknowledged the output selection", int(client.output_configured), labels
+    if hardware.air_sampler is not None:
+        yield from latency_samples("air_sensor_read", "SHT4x I2C read time", hardware.air_sampler.read_latency)
+        yield "air_sensor_errors_total", "counter", "SHT4x read errors", hardware.air_sampler.errors, {}
+        yield "air_sensor_staleness_seconds", "gauge", "Age of the last SHT4x reading", hardware.air_sampler.staleness(), {}
+    if hardware.oled_renderer is not None:
+        yield from latency_samples("oled_push", "OLED frame push over I2C", hardware.oled_renderer.i2c_time)
+    for i, panel in enumerate(panels):
+        labels = {"panel": i + 1}
+        yield "plot_bytes_pushed_total", "counter", "Plot update bytes sent to the browser", panel.plot_stream.bytes_pushed, labels
+        yield "plot_last_payload_bytes", "gauge", "Size of the last plot update", panel.plot_stream.last_payload, labels
+    yield "bus_samples_published_total", "counter", "Samples published to the viewers", sample_bus.published, {}
+    subscribers = tuple(sample_bus.subscribers)
+    yield "bus_subscribers", "gauge", "Connected stream viewers", len(subscribers), {}
+    yield "bus_queue_depth_max", "gauge", "Deepest viewer queue", max((len(s.queue) for s in subscribers), default=0), {}
+    yield "bus_coalesced_total", "counter", "Samples dropped for slow viewers", sum(s.coalesced for s in subscribers), {}
+    yield from latency_samples("event_loop_lag", "Event loop wake up delay", loop_lag.lag)
+    if sync_service is not None:
+        yield "sync_bytes_uploaded_total", "counter", "Compressed session bytes uploaded", sync_service.bytes_uploaded, {}
+        yield "sync_sessions_total", "counter", "Sessions uploaded to the collection server", sync_service.sessions_synced, {}
+        yield "sync_error", "gauge", "1 if the last sync attempt failed", int(sync_service.last_error is not None), {}
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    # Collected on the event loop, which is the only one changing the bus subscribers
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+async def start_loop_lag():
+    background_tasks.create(loop_lag.run())
+
+def update_diagnostics():
+    lines = []
+    for client in devices.clients:
+        if client.frame_reader is None:
+            continue
+        latency = client.frame_reader.latency
+        lines.append(f"{client.port}: {client.frame_reader.frames} frames, {client.frame_reader.partial_frames} partial, "
+                     f"{client.frame_reader.dropped_frames} dropped, latency {1000 * (latency.mean or 0):.1f} ms, "
+                     f"parse {1e6 * (client.parse_time.mean or 0):.0f} µs, write {1000 * (client.recorder.write_time.mean or 0):.1f} ms, "
+                     f"queue {client.sample_queue.qsize()}, {client.dropped_samples} samples dropped")
+    if hardware.air_sampler is not None:
+        staleness = hardware.air_sampler.staleness()
+        lines.append(f"SHT4x: read {1000 * (hardware.air_sampler.read_latency.mean or 0):.1f} ms, "
+                     f"{hardware.air_sampler.errors} errors, staleness {staleness or 0:.1f} s")
+    if sync_service is not None:
+        lines.append(f"Sync: {sync_service.sessions_synced} sessions, {sync_service.bytes_uploaded} bytes uploaded"
+                     + (f", error: {sync_service.last_error}" if sync_service.last_error else ""))
+    lines.append(f"Event loop lag: {1000 * (loop_lag.lag.mean or 0):.1f} ms (max {1000 * loop_lag.lag.max:.1f} ms), "
+                 f"viewers: {len(sample_bus.subscribers)}")
+    diagnostics_label.set_text("\n".join(lines))
+
+async def backfill_catalog():
+    # In a process of its own, the worker pool must not be forked from the threads of the server
+    await run.io_bound(catalog.backfill_in_subprocess, "data")
+    search_sessions()
+
+async def start_sync():
+    if sync_service is not None:
+        sync_service.start()
+
+def search_sessions():
+    since = time.time() - 86400 * days_input.value if days_input.value else None
+    rows = catalog.query(collar=collar_filter.value, user=user_filter.value, since=since)
+    for row in rows:
+        row["start"] = datetime.fromtimestamp(row["start_time"]).strftime("%Y-%m-%d %H:%M") if row["start_time"] else ""
+        row["duration"] = f"{row['end_time'] - row['start_time']:.0f}" if row["start_time"] and row["end_time"] else ""
+        row["co2_range"] = f"{row['co2_min']:.0f}-{row['co2_max']:.0f}" if row["co2_min"] is not None else ""
+        row["flux"] = f"{row['flux']:.3f}" if row["flux"] is not None else ""
+        row["r2"] = f"{row['r2']:.3f}" if row["r2"] is not None else ""
+    sessions_table.rows = rows
+    sessions_table.update()
+
+def download_sessions():
+    for row in sessions_table.selected:
+        if os.path.exists(row["path"]):
+            ui.download.file(export_csv(row["path"]) if row["path"].endswith(".li850") else row["path"])
+
+def update_hardware_status():
+    hardware_label.set_text(" | ".join(f"{name}: {state}" for name, state in hardware.status.items()))
+    if PENDING not in hardware.status.values():
+        hardware_updates.active = False
+
 def save_user():
     print(user_input.value)
     if user_input.value is not None and user_input.value != "":
-        reader.user = user_input.value
-        connect_button.enabled = True
-        connect_expansion.open()
+        devices.set_user(user_input.value)
+        for panel in panels:
+            if not panel.reader.is_connected:
+                panel.connect_button.enabled = True
+                panel.connect_expansion.open()
         user_expansion.close()
-def download():
-    ui.download.file("data/"+reader.full_filename)
+
+def add_device():
+    reader = devices.add()
+    if reader is None:
+        add_device_button.enabled = False
+        return
+    with device_column:
+        panels.append(DevicePanel(reader, len(devices.clients)))
+    add_device_button.enabled = len(devices.clients) < MAX_DEVICES
 
 ui.html('<h1>Li-850 interface for soil respiration<h1>').style(' font-weight: bold; font-size: 3rem')
+hardware_label = ui.label("").style('color: #888; font-size: 0.9rem')
 with ui.expansion('User').style('color: #888; font-weight: bold; font-size: 2rem') as user_expansion:
     with ui.row():
         user_input = ui.input("Enter User", placeholder='User')
         user_save_button = ui.button('Save User', on_click=save_user)
 
-with ui.expansion('Connection').style('color: #888; font-weight: bold; font-size: 2rem') as connect_expansion:
-    with ui.card():
-        ui.label("The ports should be:").style('color: #888; font-size: 0.75rem')
-        ui.label(" - On linux: /dev/ttyACM...     - On Windows: COM...").style('color: #888; font-size: 0.75rem')
-        with ui.row():
-            port_select = ui.select(options=reader.list_available_ports_in_list(), with_input=True)
-            refresh_button = ui.button("Refresh available ports",on_click=refresh_ports)
-        with ui.row():
-            connect_button = ui.button("Connect to Li-850",on_click=connect_device)
-            disconnect_button = ui.button("Disconnect",on_click=disconnect_device)
-        with ui.row():
-            connection_label = ui.label("Not Connected").style('color: #888; font-weight: bold; font-size: 1.2rem')
-        CO2_label = ui.label("").style('color: #099427; font-weight: bold; font-size: 1.5rem')
-
-with ui.expansion('Measurement').style('color: #888; font-weight: bold; font-size: 2rem') as measure_expansion:
-    with ui.card():
-        ui.markdown('''
-        **First**: you need to either select a filename from a list or create a new filename  
-        **Second**: when you are ready to lock the chamber on the collar click start measurement  
-        **Third**: Once the measurement is finished click on stop measurement and the file will be downloaded to your phone
-        ''').style('color: #000000; font-weight: normal; font-size: 1rem')
-        with ui.row(): 
-            filename_select = ui.select(reader.read_filenames(),with_input = True)
-            select_filename_button =ui.button("Use selected filename",on_click = select_filename)
-        with ui.row():
-            filename_input = ui.input('Or enter new filename', placeholder='filename').props("size=30").style('background-color: #f8f8f8;font-size: 1.2rem')
-            filename_input_button = ui.button('Save new filename', on_click=get_values)
-        filename_label = ui.label('No filename yet').style('color: #888; font-weight: bold; font-size: 1.5rem')
-        with ui.row():
-            start_button = ui.button("Start Measurement", on_click=start_reading, color = '#099427', icon='start').style("color:black")
-            stop_button = ui.button("Stop Measurement", on_click=stop_reading, color  ='#910617', icon='stop').style("color:black")
-            ui.button('Download data file', on_click=download)
-line_plot = ui.plotly({'data': [{'x': [0],'y': [0],'type': 'scatter','mode': 'lines+markers','name': 'data'}],
-                                    'layout': {'title': 'Real time data','xaxis': {'title':{'text':'Time (s)'} },
-                                                'yaxis': {'title':{'text':'CO2 concentration (ppm)'} }}})
+device_column = ui.column().classes('w-full')
+add_device_button = ui.button("Add another Li-850", on_click=add_device, icon='add')
+add_device()
+
+with ui.expansion('Sessions').style('color: #888; font-weight: bold; font-size: 2rem'):
+    with ui.row():
+        collar_filter = ui.select(read_filenames(), with_input=True, clearable=True, label='Collar')
+        user_filter = ui.input('User')
+        days_input = ui.number('Last days', value=7, min=0)
+        ui.button('Search', on_click=search_sessions)
+    sessions_table = ui.table(columns=[{'name': 'collar', 'label': 'Collar', 'field': 'collar', 'sortable': True},
+                                       {'name': 'user', 'label': 'User', 'field': 'user', 'sortable': True},
+                                       {'name': 'start', 'label': 'Start', 'field': 'start', 'sortable': True},
+                                       {'name': 'duration', 'label': 'Duration (s)', 'field': 'duration'},
+                                       {'name': 'samples', 'label': 'Samples', 'field': 'samples'},
+                                       {'name': 'co2_range', 'label': 'CO2 (ppm)', 'field': 'co2_range'},
+                                       {'name': 'flux', 'label': 'Flux', 'field': 'flux'},
+                                       {'name': 'r2', 'label': 'R²', 'field': 'r2'}],
+                              rows=[], row_key='path', selection='multiple').classes('w-full')
+    ui.button('Download selected sessions', on_click=download_sessions)
+
+with ui.expansion('Diagnostics').style('color: #888; font-weight: bold; font-size: 2rem'):
+    diagnostics_label = ui.label("").style('color: #000000; font-weight: normal; font-size: 0.8rem; white-space: pre-wrap; font-family: monospace')
+    ui.link('Prometheus metrics', '/metrics', new_tab=True).style('font-size: 0.8rem')
+
 ui.markdown('''
             The data you are aiming for should provide enough points to fit  
             a function. It is not necessary to go to high in concentration  
             since that will impede diffusion of CO2 from soil to chamber
         ''').style('color: #000000; font-weight: normal; font-size: 1rem')
 
-disconnect_button.enabled = False
-start_button.enabled = False
-stop_button.enabled = False
-connect_button.enabled = False
 user_expansion.open()
 
-value_updates = ui.timer(5, update_CO2_value, active=False)
-line_updates = ui.timer(5, update_line_plot, active=False)
 oled_updates = ui.timer(5, update_oled, active=True)
+hardware_updates = ui.timer(1, update_hardware_status, active=True)
+diagnostics_updates = ui.timer(5, update_diagnostics, active=True)
+app.on_startup(attach_sample_bus)
+app.on_startup(start_loop_lag)
+app.on_startup(discover_hardware)
+app.on_startup(backfill_catalog)
+app.on_startup(start_sync)
 
 
 try:
-    ui.run()     
+    ui.run()
 except KeyboardInterrupt:
     print("\nStopping...")
 finally:
-    reader.disconnect()
+    devices.disconnect_all()
+    hardware.stop()
+    if sync_service is not None:
+        sync_service.stop()
@@ -0,0 +1,86 @@
+"""
+Background sampling of the SHT4x air temperature and humidity sensor.
+The I2C read is done in its own thread at its own rate, the serial reading
+thread only picks the stored reading closest in time to each Li-850 frame.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from serial_reader import LatencyStats
+
+MISSING_VALUE = 9999
+
+
+class AirSensorSampler():
+    def __init__(self, sht, interval=1.0, max_age=5.0, history=16, lock=None):
+        self.sht = sht
+        self.i2c_lock = lock if lock is not None else nullcontext()
+        self.interval = interval
+        self.max_age = max_age
+        self.read_latency = LatencyStats()
+        self.errors = 0
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2 * self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                with self.i2c_lock:
+                    temp_air, rel_hum_air = self.sht.measurements
+                duration = time.monotonic() - start
+                self.read_latency.add(duration)
+                with self._lock:
+                    self._history.append((start + duration / 2, temp_air, rel_hum_air))
+            except Exception as e:
+                self.errors += 1
+                print(f"Error reading air sensor: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def latest(self):
+        """Last reading as (timestamp, temperature, humidity) or None"""
+        with self._lock:
+            return self._history[-1] if self._history else None
+
+    def nearest(self, timestamp=None):
+        """
+        Air temperature and humidity closest to timestamp (time.monotonic()).
+        Returns the missing values if no reading is recent enough.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            history = tuple(self._history)
+        if not history:
+            return MISSING_VALUE, MISSING_VALUE
+        reading = min(history, key=lambda r: abs(r[0] - timestamp))
+        if abs(reading[0] - timestamp) > self.max_age:
+            return MISSING_VALUE, MISSING_VALUE
+        return reading[1], reading[2]
+
+    def staleness(self):
+        """Age in seconds of the last reading"""
+        reading = self.latest()
+        return None if reading is None else time.monotonic() - reading[0]
+
+    def stats(self):
+        return {"reads": self.read_latency.count, "errors": self.errors,
+                "read_latency": self.read_latency.stats(), "staleness": self.staleness()}
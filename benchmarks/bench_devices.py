@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Throughput of several Li_850_client sessions recording at the same time.
+Each analyzer is simulated with a pyserial loop:// port fed with recorded frames
+at the given rate, the files are written to a temporary data directory.
+Usage: python benchmarks/bench_devices.py [devices] [rate in Hz] [duration in s]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+from device_manager import DeviceManager
+
+
+def feed(client, frames, rate, stop):
+    i = 0
+    while not stop.is_set():
+        client.serial_connection.write(frames[i % len(frames)].encode('utf-8') + b"\n")
+        i += 1
+        time.sleep(1 / rate)
+
+
+def main():
+    n_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    with open(os.path.join(HERE, "frames_li850.txt"), "r") as f:
+        frames = [line.strip() for line in f.readlines()]
+
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("data")
+    devices = DeviceManager(max_devices=n_devices, timeout=0.1)
+    stop = threading.Event()
+    feeders = []
+    for i in range(n_devices):
+        client = devices.add()
+        devices.connect(client, "loop://")
+        client.filename = f"simulated_{i}"
+        client.update_full_filename()
+        client.recording = True
+        client.start_continuous_reading()
+        feeders.append(threading.Thread(target=feed, args=(client, frames, rate, stop), daemon=True))
+    for feeder in feeders:
+        feeder.start()
+    time.sleep(duration)
+    stats = devices.stats()
+    stop.set()
+    for client in devices.clients:
+        client.stop_reading()
+
+    print(f"{n_devices} simulated analyzers at {rate} Hz for {duration} s")
+    for i, device in enumerate(stats):
+        latency = device["reader"]["latency"]
+        print(f"analyzer {i}: {device['frames_per_s']:.1f} frames/s, {device['samples_per_s']:.1f} samples/s, "
+              f"partial {device['reader']['partial_frames']}, dropped {device['reader']['dropped_frames']}, "
+              f"mean latency {1000 * (latency['mean'] or 0):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
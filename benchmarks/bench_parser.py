@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the LI-850 frame parser against the previous regex path.
+The recorded frames in frames_li850.txt include a truncated and two garbled lines.
+The legacy path is run twice per line, as _continuous_read used to do.
+"""
+
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+from li850_parser import parse_frame
+
+REPEAT = 500
+
+
+def legacy_extract(xml_data):
+    """Copy of the regex based extract_co2_h2o, without the air sensor read"""
+    cleaned_data = re.sub(r'<raw>.*?</raw>', '', xml_data, flags=re.DOTALL)
+    co2_match = re.search(r'<co2>(.*?)</co2>', cleaned_data)
+    co2_value = float(co2_match.group(1)) if co2_match else None
+    h2o_match = re.search(r'<h2o>(.*?)</h2o>', cleaned_data)
+    h2o_value = float(h2o_match.group(1)) if h2o_match else None
+    press_match = re.search(r'<cellpres>(.*?)</cellpres>', cleaned_data)
+    press_value = float(press_match.group(1)) if press_match else None
+    temp_match = re.search(r'<celltemp>(.*?)</celltemp', cleaned_data)
+    temp_value = float(temp_match.group(1)) if temp_match else None
+    return (co2_value, h2o_value, press_value, temp_value)
+
+
+def legacy_line(line):
+    try:
+        legacy_extract(line)
+        legacy_extract(line)
+    except ValueError:
+        # garbled numbers made the old path raise and stop the reading thread
+        pass
+
+
+def load_frames():
+    with open(os.path.join(HERE, "frames_li850.txt"), "r") as f:
+        return [line.strip() for line in f.readlines()]
+
+
+def lines_per_second(function, lines):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for line in lines:
+            function(line)
+    return REPEAT * len(lines) / (time.perf_counter() - start)
+
+
+def main():
+    lines = load_frames()
+    legacy = lines_per_second(legacy_line, lines)
+    single_pass = lines_per_second(parse_frame, lines)
+    print(f"{len(lines)} recorded frames x {REPEAT}")
+    print(f"legacy regex path (2 calls/line): {legacy:,.0f} lines/s")
+    print(f"single pass parse_frame:         {single_pass:,.0f} lines/s ({single_pass / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
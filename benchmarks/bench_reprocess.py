@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the batch flux reprocessing.
+Writes synthetic 10 minute sessions at 1 Hz, half as .li850 files and half as
+csv files of the previous versions, then reports sessions/second for one
+process, for all the cores, and for a rerun served from the cache. The
+per-sample FluxEngine path of the catalog is timed for comparison.
+Usage: python benchmarks/bench_reprocess.py --sessions 400
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from recorder import format_csv_row
+from reprocess import reprocess
+from sample_buffer import CHANNELS
+from session_catalog import summarize_file
+from session_store import SessionWriter
+
+DURATION = 600
+PARAMETERS = {"volume": 4.0, "area": 317.8, "dead_band": 30.0, "window": 120.0}
+
+
+def rows(seed):
+    rng = random.Random(seed)
+    slope = rng.uniform(0.05, 1.0)
+    for t in range(DURATION):
+        yield (float(t), 415.0 + slope * t + rng.gauss(0, 0.3), 19.7, 97.4 + rng.gauss(0, 0.01),
+               51.4, 21.3, 65.2)
+
+
+def write_sessions(directory, count):
+    writer = SessionWriter(CHANNELS, fsync_rows=10 ** 9, fsync_interval=10 ** 9)
+    paths = []
+    for i in range(count):
+        base = os.path.join(directory, f"collar{i}_2026_{1 + i % 12:02d}_{1 + i % 28:02d}_10_{i % 60:02d}")
+        if i % 2 == 0:
+            path = base + ".li850"
+            writer.open(path, metadata={"user": "bench", "filename": f"collar{i}", "start_time": 0.0})
+            for row in rows(i):
+                writer.write_row(row)
+            writer.close()
+        else:
+            path = base + ".csv"
+            with open(path, "w") as f:
+                f.write(format_csv_row(["rcrd_nb"] + CHANNELS + ["user"]))
+                for j, row in enumerate(rows(i)):
+                    f.write(format_csv_row([j] + list(row) + ["bench"]))
+        paths.append(path)
+    return paths
+
+
+def bench(label, paths, **kwargs):
+    start = time.perf_counter()
+    summary, cached = reprocess(paths, PARAMETERS, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {len(summary) / elapsed:.1f} sessions/s ({len(summary)} sessions, {cached} cached, {elapsed:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the batch flux reprocessing")
+    parser.add_argument("--sessions", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_sessions(directory, args.sessions)
+        cache_dir = os.path.join(directory, "cache")
+        print(f"{len(paths)} sessions of {DURATION} samples, {os.cpu_count()} cores")
+
+        start = time.perf_counter()
+        sample = paths[:max(2, len(paths) // 10)]
+        for path in sample:
+            summarize_file(path)
+        elapsed = time.perf_counter() - start
+        print(f"FluxEngine per sample, 1 process: {len(sample) / elapsed:.1f} sessions/s")
+
+        bench("NumPy, 1 process", paths, workers=1)
+        bench(f"NumPy, {os.cpu_count()} processes", paths)
+        bench("NumPy, cold cache", paths, cache_dir=cache_dir)
+        bench("NumPy, warm cache", paths, cache_dir=cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the in-memory sample buffer.
+Reports the memory used by one hour of 1 Hz data and the cost of appending a sample,
+compared with the previous one-row DataFrame + concat approach when pandas is installed.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sample_buffer import SampleBuffer, CHANNELS
+
+ONE_HOUR = 3600
+SAMPLE = (0.0, 412.5, 19.7, 97.4, 51.4, 21.3, 65.2)
+
+
+def bench_buffer(n):
+    buffer = SampleBuffer(capacity=16)
+    start = time.perf_counter()
+    for i in range(n):
+        buffer.append((float(i),) + SAMPLE[1:], user="user")
+    elapsed = time.perf_counter() - start
+    return buffer, elapsed
+
+
+def bench_concat(n):
+    import pandas as pd
+    start = time.perf_counter()
+    data_frame = None
+    for i in range(n):
+        dict_values = dict(zip(CHANNELS, (float(i),) + SAMPLE[1:]))
+        dict_values["user"] = "user"
+        if data_frame is None:
+            data_frame = pd.DataFrame(dict_values, index=[0])
+        else:
+            data_frame = pd.concat([data_frame, pd.DataFrame(dict_values, index=[i])])
+    elapsed = time.perf_counter() - start
+    return data_frame, elapsed
+
+
+def main():
+    buffer, elapsed = bench_buffer(ONE_HOUR)
+    filled_bytes = ONE_HOUR * (8 * len(CHANNELS) + 2)
+    print(f"SampleBuffer: {filled_bytes / 1024:.1f} KiB of data per hour at 1 Hz "
+          f"({buffer.nbytes() / 1024:.1f} KiB allocated)")
+    print(f"SampleBuffer: {1e6 * elapsed / ONE_HOUR:.2f} us per append")
+    try:
+        data_frame, elapsed = bench_concat(ONE_HOUR)
+    except ImportError:
+        print("pandas not installed, skipping the DataFrame comparison")
+        return
+    print(f"DataFrame concat: {data_frame.memory_usage(deep=True).sum() / 1024:.1f} KiB per hour at 1 Hz")
+    print(f"DataFrame concat: {1e6 * elapsed / ONE_HOUR:.2f} us per append")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Startup time of the web interface.
+1. Import profile (python -X importtime) of the modules Li-850_nicegui.py imports before ui.run(), top entries by cumulative time.
+2. Time from launching Li-850_nicegui.py to the first HTTP response of the interface.
+Usage: python benchmarks/bench_startup.py [--port 8080] [--timeout 120]
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+APP = os.path.join(ROOT, "Li-850_nicegui.py")
+
+
+def app_imports(path=APP):
+    """Import statement of the modules the app loads at module level, before ui.run()"""
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules.extend(name for name in names if name not in modules)
+    return "import " + ", ".join(modules)
+
+
+def import_profile(top=15):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", app_imports()],
+                            cwd=ROOT, capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        entries.append((int(cumulative_us), int(self_us), name.rstrip()))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1])
+    # Top level imports are indented by a single space, nested ones by more
+    total = sum(e[0] for e in entries if not e[2].startswith("  "))
+    print(f"Imports before ui.run(): {total / 1e6:.2f} s cumulative")
+    for cumulative_us, self_us, name in sorted(entries, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1e3:9.1f} ms  {name.strip()}")
+
+
+def time_to_first_response(port, timeout):
+    start = time.monotonic()
+    app = subprocess.Popen([sys.executable, APP], cwd=ROOT,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    response.read()
+                    return time.monotonic() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.05)
+        return None
+    finally:
+        app.terminate()
+        app.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the Li-850 web interface")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    import_profile()
+    elapsed = time_to_first_response(args.port, args.timeout)
+    if elapsed is None:
+        print(f"No HTTP response within {args.timeout} s")
+    else:
+        print(f"Time to first HTTP response: {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+End to end load test of the recording path against the simulated Li-850.
+The simulator runs in its own process on a pseudo terminal and a Li_850_client
+records from it into a temporary data directory until the requested amount of
+1 Hz equivalent data is reached, e.g. 4 hours of field data at 200 frames/s.
+Reports CPU time, RSS, per sample latency and file write amplification.
+Usage: python benchmarks/loadtest.py --hours 4 --rate 200 --garbage 0.01 --drop 0.01
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+from li850_client import Li_850_client
+
+
+def read_proc_io():
+    """Bytes passed to write() and bytes actually sent to storage by this process"""
+    values = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f.readlines():
+                key, value = line.split(":")
+                values[key] = int(value)
+    except OSError:
+        pass
+    return values.get("wchar", 0), values.get("write_bytes", 0)
+
+
+def read_rss_kib():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f.readlines():
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the Li-850 recording path")
+    parser.add_argument("--hours", type=float, default=1.0, help="hours of 1 Hz data to record")
+    parser.add_argument("--rate", type=float, default=100.0, help="simulator frames per second")
+    parser.add_argument("--garbage", type=float, default=0.0)
+    parser.add_argument("--drop", type=float, default=0.0)
+    args = parser.parse_args()
+    target = int(args.hours * 3600)
+
+    simulator = subprocess.Popen([sys.executable, os.path.join(ROOT, "li850_simulator.py"), "--rate", str(args.rate),
+                                  "--garbage", str(args.garbage), "--drop", str(args.drop), "--seed", "850"],
+                                 stdout=subprocess.PIPE, text=True)
+    port = simulator.stdout.readline().strip()
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("data")
+    try:
+        client = Li_850_client(port=port, timeout=0.5)
+        if not client.connect():
+            return
+        client.filename = "loadtest"
+        client.update_full_filename()
+        rss_start = read_rss_kib()
+        wchar_start, write_bytes_start = read_proc_io()
+        usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.monotonic()
+        client.recording = True
+        client.start_continuous_reading()
+        while client.samples_recorded < target and client.is_reading:
+            time.sleep(0.5)
+        client.stop_reading()
+        wall = time.monotonic() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wchar, write_bytes = read_proc_io()
+        rss_end = read_rss_kib()
+        client.disconnect()
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+    cpu = (usage.ru_utime - usage_start.ru_utime) + (usage.ru_stime - usage_start.ru_stime)
+    file_size = os.path.getsize(os.path.join("data", client.full_filename))
+    reader_stats = client.frame_reader.stats()
+    latency = reader_stats["latency"]
+    samples = client.samples_recorded
+    print(f"{samples} samples ({samples / 3600:.2f} h at 1 Hz) in {wall:.1f} s at {args.rate} frames/s")
+    print(f"frames {reader_stats['frames']}, partial {reader_stats['partial_frames']}, "
+          f"dropped {reader_stats['dropped_frames']}")
+    print(f"CPU: {cpu:.2f} s ({100 * cpu / wall:.1f} % of one core), {1e6 * cpu / max(samples, 1):.0f} us per sample")
+    print(f"RSS: {rss_start / 1024:.1f} MiB -> {rss_end / 1024:.1f} MiB (max {usage.ru_maxrss / 1024:.1f} MiB)")
+    print(f"latency frame -> memory: mean {1000 * (latency['mean'] or 0):.3f} ms, max {1000 * latency['max']:.3f} ms")
+    print(f"file {file_size} bytes, write() {wchar - wchar_start} bytes "
+          f"(amplification {(wchar - wchar_start) / max(file_size, 1):.2f}), "
+          f"storage {write_bytes - write_bytes_start} bytes")
+
+
+if __name__ == "__main__":
+    main()
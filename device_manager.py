@@ -0,0 +1,93 @@
+"""
+Holds the Li_850_client sessions of the analyzers connected to the Pi.
+Every session has its own serial port, reading thread, buffer and data file.
+The I2C air sensor and OLED screen are shared through SharedHardware.
+"""
+
+import time
+
+from li850_client import Li_850_client
+
+
+class DeviceManager():
+    def __init__(self, air_sampler=None, max_devices=4, baudrate=9600, timeout=1, bus=None):
+        self.air_sampler = air_sampler
+        self.bus = bus
+        self.max_devices = max_devices
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.clients = []
+        self.user = "None"
+        self._started = {}
+
+    def add(self, port=None):
+        """Create a new session, returns None when the maximum number of analyzers is reached"""
+        if len(self.clients) >= self.max_devices:
+            print(f"Maximum number of analyzers reached ({self.max_devices})")
+            return None
+        client = Li_850_client(port=port, baudrate=self.baudrate, timeout=self.timeout,
+                               air_sampler=self.air_sampler)
+        client.user = self.user
+        client.bus = self.bus
+        self.clients.append(client)
+        return client
+
+    def remove(self, client):
+        client.disconnect()
+        if client in self.clients:
+            self.clients.remove(client)
+        self._started.pop(id(client), None)
+
+    def set_air_sampler(self, air_sampler):
+        """Share the air sensor with all sessions once the hardware discovery found it"""
+        self.air_sampler = air_sampler
+        for client in self.clients:
+            client.air_sampler = air_sampler
+            client.sensor = air_sampler is not None
+
+    def set_user(self, user):
+        self.user = user
+        for client in self.clients:
+            client.user = user
+
+    def port_in_use(self, port, client=None):
+        """True if another session is connected to this port"""
+        if port.startswith("loop://"):
+            # Every loop:// url opens its own simulated port
+            return False
+        return any(other is not client and other.is_connected and other.port == port for other in self.clients)
+
+    def connect(self, client, port):
+        if self.port_in_use(port, client):
+            print(f"{port} is already used by another analyzer")
+            return False
+        if client.connect(port=port):
+            self._started[id(client)] = (time.monotonic(), 0, client.samples_recorded)
+            return True
+        return False
+
+    def any_recording(self):
+        return any(client.recording for client in self.clients)
+
+    def active_paths(self):
+        """Session files still being written"""
+        return ["data/" + client.full_filename for client in self.clients
+                if client.filename_exists and getattr(client, "full_filename", None)]
+
+    def stats(self):
+        """Frames and recorded samples per second of each connected analyzer since its connection"""
+        stats = []
+        for client in self.clients:
+            if not client.is_connected or client.frame_reader is None:
+                continue
+            start, frames0, samples0 = self._started.get(id(client), (time.monotonic(), 0, 0))
+            elapsed = max(time.monotonic() - start, 1e-9)
+            stats.append({"port": client.port,
+                          "frames_per_s": (client.frame_reader.frames - frames0) / elapsed,
+                          "samples_per_s": (client.samples_recorded - samples0) / elapsed,
+                          "reader": client.frame_reader.stats()})
+        return stats
+
+    def disconnect_all(self):
+        for client in self.clients:
+            client.disconnect()
@@ -7,6 +7,9 @@ For Raspberry Pi with SSD1306 OLED Display (128x64 or 128x32)
 import subprocess
 import socket
 import time
+from contextlib import nullcontext
+
+from serial_reader import LatencyStats
 
 def get_ssid():
     """Get the current WiFi SSID"""
@@ -31,6 +34,45 @@ def get_local_ip():
     except Exception:
         return "No Connection"
 
+class OledRenderer():
+    """Draws lines of text on the OLED and pushes the frame over I2C only when the text changed"""
+    def __init__(self, disp, image, draw, font, line_height=12, margin=2, lock=None):
+        self.disp = disp
+        self.i2c_lock = lock if lock is not None else nullcontext()
+        self.image = image
+        self.draw = draw
+        self.font = font
+        self.line_height = line_height
+        self.margin = margin
+        self.i2c_time = LatencyStats()
+        self.skipped = 0
+        self._last_lines = None
+
+    def render(self, lines):
+        """Returns True if the screen was updated"""
+        lines = tuple(lines)
+        if lines == self._last_lines:
+            self.skipped += 1
+            return False
+        # The same image is cleared and reused instead of allocating a new one
+        self.draw.rectangle((0, 0, self.image.width, self.image.height), outline=0, fill=0)
+        for i, line in enumerate(lines):
+            self.draw.text((self.margin, self.margin + i * self.line_height), line, font=self.font, fill=255)
+        with self.i2c_lock:
+            start = time.monotonic()
+            self.disp.image(self.image)
+            self.disp.show()
+        self.i2c_time.add(time.monotonic() - start)
+        self._last_lines = lines
+        return True
+
+    def invalidate(self):
+        """Force the next render to push, e.g. after something else drew on the screen"""
+        self._last_lines = None
+
+    def stats(self):
+        return {"i2c_time": self.i2c_time.stats(), "skipped": self.skipped}
+
 def main():
     try:
         while True:
@@ -0,0 +1,148 @@
+"""
+Online computation of the chamber CO2 flux.
+The slope of CO2 against elapsed time is fitted by least squares updated in
+constant time per sample, over the samples after the dead band and optionally
+over a sliding window. The slope is converted to a flux with the chamber
+volume and collar area and the mean cell pressure and temperature:
+
+    flux (umol m-2 s-1) = dCO2/dt (ppm s-1) * P V / (R T A)
+"""
+
+import math
+import threading
+from collections import deque
+
+R = 8.314462618  # J mol-1 K-1
+
+DEFAULT_VOLUME = 4.0  # chamber + tubing volume in L
+DEFAULT_AREA = 317.8  # collar area in cm2
+DEFAULT_DEAD_BAND = 30.0  # s
+
+
+class IncrementalRegression():
+    """Least squares fit of y = a + b x with O(1) addition and removal of points"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.x0 = None
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def add(self, x, y, weight=1):
+        if self.x0 is None:
+            self.x0 = x
+        # x is shifted by the first point to keep the sums well conditioned
+        x = x - self.x0
+        self.n += weight
+        self.sx += weight * x
+        self.sy += weight * y
+        self.sxx += weight * x * x
+        self.sxy += weight * x * y
+        self.syy += weight * y * y
+
+    def remove(self, x, y):
+        self.add(x, y, weight=-1)
+        if self.n == 0:
+            self.reset()
+
+    def fit(self):
+        """Returns (slope, intercept at x=0, r2) or None with less than 3 points"""
+        if self.n < 3:
+            return None
+        var_x = self.n * self.sxx - self.sx * self.sx
+        var_y = self.n * self.syy - self.sy * self.sy
+        if var_x <= 0:
+            return None
+        cov = self.n * self.sxy - self.sx * self.sy
+        slope = cov / var_x
+        intercept = (self.sy - slope * self.sx) / self.n - slope * self.x0
+        r2 = cov * cov / (var_x * var_y) if var_y > 0 else 1.0
+        return slope, intercept, r2
+
+
+class FluxEngine():
+    def __init__(self, volume=DEFAULT_VOLUME, area=DEFAULT_AREA, dead_band=DEFAULT_DEAD_BAND,
+                 window=None, exponential=False):
+        self.volume = volume
+        self.area = area
+        self.dead_band = dead_band
+        self.window = window
+        self.exponential = exponential
+        self.linear = IncrementalRegression()
+        self.log_linear = IncrementalRegression()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.linear.reset()
+            self.log_linear.reset()
+            self._samples = deque()
+            self._pressure_sum = self._pressure_n = 0.0
+            self._temp_sum = self._temp_n = 0.0
+
+    def add(self, elapsed_time, co2, pressure=None, temperature=None):
+        """Add one sample, pressure in kPa and temperature in degC as given by the Li-850"""
+        if co2 is None or elapsed_time < self.dead_band:
+            return
+        with self._lock:
+            sample = (elapsed_time, co2, pressure, temperature)
+            self._add(sample, 1)
+            self._samples.append(sample)
+            if self.window is not None:
+                while elapsed_time - self._samples[0][0] > self.window:
+                    self._add(self._samples.popleft(), -1)
+
+    def _add(self, sample, weight):
+        elapsed_time, co2, pressure, temperature = sample
+        if weight > 0:
+            self.linear.add(elapsed_time, co2)
+        else:
+            self.linear.remove(elapsed_time, co2)
+        if self.exponential and co2 > 0:
+            if weight > 0:
+                self.log_linear.add(elapsed_time, math.log(co2))
+            else:
+                self.log_linear.remove(elapsed_time, math.log(co2))
+        if pressure is not None:
+            self._pressure_sum += weight * pressure
+            self._pressure_n += weight
+        if temperature is not None:
+            self._temp_sum += weight * temperature
+            self._temp_n += weight
+
+    def result(self):
+        """
+        Current flux estimate.
+
+        Returns:
+            dict: slope (ppm s-1), flux (umol m-2 s-1), r2 and n, with the exponential
+            fit as flux_exp and r2_exp when enabled, or None if not enough samples
+        """
+        with self._lock:
+            fit = self.linear.fit()
+            if fit is None:
+                return None
+            slope, _, r2 = fit
+            result = {"slope": slope, "flux": None, "r2": r2, "n": self.linear.n}
+            factor = self._conversion_factor()
+            if factor is not None:
+                result["flux"] = slope * factor
+            if self.exponential:
+                log_fit = self.log_linear.fit()
+                if log_fit is not None and factor is not None:
+                    # C = C0 exp(k t): initial rate at the first fitted sample is k * C(t0)
+                    k, ln_c0, r2_exp = log_fit
+                    t0 = self._samples[0][0]
+                    result["flux_exp"] = k * math.exp(ln_c0 + k * t0) * factor
+                    result["r2_exp"] = r2_exp
+            return result
+
+    def _conversion_factor(self):
+        """Moles of air per m2 of collar, to convert ppm s-1 into umol m-2 s-1"""
+        if self._pressure_n <= 0 or self._temp_n <= 0 or not self.area:
+            return None
+        pressure = 1000 * self._pressure_sum / self._pressure_n  # kPa to Pa
+        temperature = 273.15 + self._temp_sum / self._temp_n
+        return pressure * (self.volume / 1000) / (R * temperature * self.area / 10000)
@@ -0,0 +1,86 @@
+"""
+I2C peripherals of the Raspberry Pi shared by all the connected analyzers:
+the SHT4x air sensor and the SSD1306 OLED screen.
+Both are driven from different threads so every bus access goes through i2c_lock.
+Discovery is slow on a Pi 3 (board, PIL and the adafruit drivers plus the bus probing),
+so it is done by discover() in the background after the web interface is served.
+"""
+
+import threading
+
+from air_sensor import AirSensorSampler
+from display_oled import OledRenderer
+
+PENDING = "starting"
+ONLINE = "online"
+MISSING = "not found"
+
+
+class SharedHardware():
+    def __init__(self, sensor_interval=1.0):
+        self.sensor_interval = sensor_interval
+        self.i2c_lock = threading.Lock()
+        self.i2c = None
+        self.sht = None
+        self.sensor = False
+        self.air_sampler = None
+        self.oled = False
+        self.oled_renderer = None
+        self.status = {"i2c": PENDING, "air sensor": PENDING, "oled": PENDING}
+
+    def discover(self):
+        """Import the hardware libraries and probe the I2C devices, blocking"""
+        try:
+            import board
+            self.i2c = board.I2C()
+            self.status["i2c"] = ONLINE
+        except Exception as e:
+            self.status["i2c"] = MISSING
+            print(e)
+
+        try:
+            import adafruit_sht4x
+            self.sht = adafruit_sht4x.SHT4x(self.i2c)
+            print("Found SHT4x with serial number", hex(self.sht.serial_number))
+            self.sht.mode = adafruit_sht4x.Mode.NOHEAT_HIGHPRECISION
+            self.air_sampler = AirSensorSampler(self.sht, interval=self.sensor_interval, lock=self.i2c_lock)
+            self.air_sampler.start()
+            self.sensor = True
+            self.status["air sensor"] = ONLINE
+        except Exception as e:
+            print(e)
+            self.sensor = False
+            self.status["air sensor"] = MISSING
+
+        try:
+            from PIL import Image, ImageDraw, ImageFont
+            import adafruit_ssd1306
+            self.disp = adafruit_ssd1306.SSD1306_I2C(128, 64, self.i2c)
+            self.disp.fill(50)
+            self.disp.show()
+            # Create blank image for drawing.
+            # Make sure to create image with mode '1' for 1-bit color.
+            self.oled_width = self.disp.width
+            self.oled_height = self.disp.height
+            self.image = Image.new("1", (self.oled_width, self.oled_height))
+            # Get drawing object to draw on image.
+            self.draw = ImageDraw.Draw(self.image)
+            # Load default font.
+            self.disp.fill(0)
+            self.oled_font = ImageFont.load_default()
+            self.draw.text((2,10), text = "Loading...",font = self.oled_font,fill=255)
+            self.disp.image(self.image)
+            self.disp.show()
+            self.oled_renderer = OledRenderer(self.disp, self.image, self.draw, self.oled_font, lock=self.i2c_lock)
+            self.oled = True
+            self.status["oled"] = ONLINE
+            print("Oled screen successful")
+
+        except Exception as e:
+            self.oled = False
+            self.status["oled"] = MISSING
+            print(e)
+
+    def stop(self):
+        if self.air_sampler is not None:
+            self.air_sampler.stop()
@@ -0,0 +1,326 @@
+"""
+Client for one Li-850 analyzer connected on a serial port.
+Each client has its own reading thread, sample buffer, flux engine and data file,
+the I2C air sensor is shared between clients through an AirSensorSampler.
+"""
+
+import serial
+import time
+import serial.tools.list_ports
+import threading
+import queue
+from datetime import datetime
+
+from session_store import SessionWriter, EXTENSION
+from sample_buffer import SampleBuffer, CHANNELS
+from li850_parser import parse_frame
+from serial_reader import FrameReader, LatencyStats
+from air_sensor import MISSING_VALUE
+from flux import FluxEngine
+from li850_config import AnalyzerConfigurator, ConfigError, NEEDED_FIELDS
+
+# Queued by the reader thread after the last sample of a recording, the writer closes the file
+FINISH = object()
+
+def read_filenames(path="config_filenames.ini"):
+    """Collar names listed in the config file, without the optional duration and dead band of the scheduler"""
+    try:
+        with open(path,"r") as f:
+            filename_list = [line.split(",")[0].strip() for line in f.readlines()]
+    except:
+        filename_list = []
+        print("No filename config file found")
+    return filename_list
+
+class Li_850_client():
+    def __init__(self, port=None, baudrate=9600,timeout=1,air_sampler=None,queue_size=600,
+                 configure_output=True, output_interval=None, config_baudrate=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        # Output settings sent on connect: only the stored fields, interval in s and baud rate when given
+        self.configure_output = configure_output
+        self.output_interval = output_interval
+        self.config_baudrate = config_baudrate
+        self.configurator = None
+        self.output_configured = False
+        self.serial_connection = None
+        self.is_reading = False
+        self.read_thread = None
+        self.write_thread = None
+        self.sample_queue = queue.Queue(maxsize=queue_size)
+        self.dropped_samples = 0
+        self.frame_reader = None
+        self.new_recording = True
+        self.buffer = SampleBuffer(CHANNELS, capacity=3600)
+        self.flux = FluxEngine()
+        self.filename = None
+        self.filename_exists = False
+        self.recording = False
+        self.CO2_conc = None
+        self.is_connected = False
+        self.user = "None"
+        self.air_sampler = air_sampler
+        self.sensor = air_sampler is not None
+        self.recorder = SessionWriter(CHANNELS, fsync_rows=10, fsync_interval=5.0)
+        self.samples_recorded = 0
+        # Samples stored in the file of the current or last recording, 0 if no file was opened
+        self.session_samples = 0
+        self.bus = None
+        self.parse_time = LatencyStats()
+        self.recording_closed = threading.Event()
+
+    def list_available_ports(self):
+        """List all available serial ports"""
+        ports = serial.tools.list_ports.comports()
+        available_ports = []
+        for port in ports:
+            available_ports.append({'device': port.device,'name': port.name,'description': port.description})
+        return available_ports
+    
+    def list_available_ports_in_list(self):
+        """List all available serial ports"""
+        ports = serial.tools.list_ports.comports()
+        available_ports = []
+        for port in ports:
+            if "/dev/ttyS" not in port.device:
+                available_ports.append(port.device)
+        return available_ports
+
+    def read_filenames(self):
+        return read_filenames()
+    
+    def connect(self, port=None):
+        if port:
+            self.port = port
+        if not self.port:
+            raise ValueError("No port specified in this function or init")
+        try:
+            # serial_for_url also accepts pyserial urls such as loop:// for simulated ports
+            self.serial_connection = serial.serial_for_url(self.port,baudrate=self.baudrate,timeout=self.timeout)
+            self.frame_reader = FrameReader(self.serial_connection)
+            print(f"Connected to {self.port} at {self.baudrate} baud")
+            self.is_connected = True
+            if self.configure_output:
+                self.configure_analyzer()
+            return True
+        except serial.SerialException as e:
+            print(f"Failed to connect to {self.port}: {e}")
+            return False
+
+    def configure_analyzer(self):
+        """Ask the analyzer for the stored fields only, the default output is kept if it does not acknowledge"""
+        self.configurator = AnalyzerConfigurator(self.serial_connection, reply_timeout=2 * self.timeout)
+        try:
+            self.configurator.apply(fields=NEEDED_FIELDS, outrate=self.output_interval, baudrate=self.config_baudrate)
+            self.output_configured = True
+            print(f"Configured {self.port} output: {', '.join(NEEDED_FIELDS)} at {self.serial_connection.baudrate} baud")
+        except (ConfigError, serial.SerialException) as e:
+            self.output_configured = False
+            print(f"Keeping the analyzer output settings of {self.port}: {e}")
+
+    def restore_analyzer(self):
+        if self.configurator is None:
+            return
+        try:
+            self.configurator.restore()
+        except (ConfigError, serial.SerialException) as e:
+            print(f"Unable to restore the analyzer settings of {self.port}: {e}")
+        self.configurator = None
+        self.output_configured = False
+
+    def read_line(self):
+        if not self.serial_connection or not self.serial_connection.is_open:
+            print("Serial port not connected")
+            return None
+        try:
+            if self.serial_connection.in_waiting > 0:
+                line = self.serial_connection.readline().decode('utf-8').strip()
+                return line
+        except Exception as e:
+            print(f"Error reading from serial port: {e}")
+        return None
+    
+    def stop_recording(self):
+        self.recording = False
+    
+    def disconnect(self):
+        """Disconnect from the serial port"""
+        self.stop_reading()
+        if self.serial_connection and self.serial_connection.is_open:
+            # The reader thread is stopped, the replies can be read here
+            self.restore_analyzer()
+            self.serial_connection.close()
+            print(f"Disconnected from {self.port}")
+        self.CO2_conc = None
+        self.is_connected = False
+
+    def _continuous_read(self):
+        """Internal method for continuous reading in a separate thread"""
+        session_open = False
+        while self.is_reading and self.serial_connection and self.serial_connection.is_open:
+            try:
+                # Blocks until a full frame arrived or the serial timeout expired
+                received = self.frame_reader.read_frame()
+                if received is not None:
+                    line, arrival = received
+                    parse_start = time.perf_counter()
+                    frame = parse_frame(line)
+                    self.parse_time.add(time.perf_counter() - parse_start)
+                    self.CO2_conc = frame.co2
+                    if self.recording:
+                        # Handed to the writer thread so a slow SD card write never delays the serial reads
+                        try:
+                            self.sample_queue.put_nowait((time.time(), arrival, self.frame_values(frame, arrival)))
+                            session_open = True
+                        except queue.Full:
+                            self.dropped_samples += 1
+                    elif session_open:
+                        # The recording was finished while reading continues, closed after its last sample
+                        self.sample_queue.put(FINISH)
+                        session_open = False
+                    if self.bus is not None:
+                        self.publish_sample(frame)
+            except Exception as e:
+                print(f"Error in continuous read: {e}")
+                break
+    
+    def _write_samples(self):
+        """Internal method of the writer thread, stores the queued samples until it gets None"""
+        while True:
+            item = self.sample_queue.get()
+            if item is None:
+                break
+            if item is FINISH:
+                self.save_data_in_dataframe(finished = True)
+                self.recording_closed.set()
+                continue
+            timestamp, arrival, values = item
+            try:
+                self.save_data_in_dataframe(values = values, finished = False, timestamp = timestamp)
+                self.frame_reader.latency.add(time.monotonic() - arrival)
+            except Exception as e:
+                print(f"Error saving sample: {e}")
+
+    def publish_sample(self, frame):
+        """Send the frame once to the sample bus, it is fanned out to all the viewers from there"""
+        sample = {"port": self.port, "time": time.time(), "co2": frame.co2, "h2o": frame.h2o,
+                  "cellpres": frame.cellpres, "celltemp": frame.celltemp, "recording": self.recording}
+        if self.recording and len(self.buffer):
+            sample["elapsed_time"] = self.buffer.last('elapsed_time')
+        self.bus.publish(self.port, sample)
+
+    def start_continuous_reading(self):
+        """Start reading continuously in a separate thread"""
+        if not self.serial_connection or not self.serial_connection.is_open:
+            print("Serial port not connected")
+            return False
+            
+        if self.is_reading:
+            print("Already reading continuously")
+            return False 
+        self.is_reading = True
+        self.serial_connection.reset_input_buffer() # flush the serial input to avoid getting any old values
+        self.frame_reader.reset()
+        self.write_thread = threading.Thread(target=self._write_samples, daemon=True)
+        self.write_thread.start()
+        self.read_thread = threading.Thread(target=self._continuous_read, daemon=True)
+        self.read_thread.start()
+        print("Started continuous reading")
+        return True
+    
+    def update_full_filename(self):
+        now = datetime.now()
+        datetime_string = f"_{now.year:04d}_{now.month:02d}_{now.day:02d}_{now.hour:02d}_{now.minute:02d}{EXTENSION}"
+        self.full_filename = self.filename+datetime_string
+
+    def session_summary(self):
+        """Catalog entry of the last recorded session, from the samples kept in memory"""
+        co2 = self.buffer.view('CO2_ppm')
+        result = self.flux.result() or {}
+        n = len(self.buffer)
+        return {"path": self.recorder.path, "collar": self.filename, "user": self.user,
+                "start_time": self.start_time,
+                "end_time": self.start_time + self.buffer.last('elapsed_time') if n else self.start_time,
+                "samples": n, "co2_min": min(co2) if n else None, "co2_max": max(co2) if n else None,
+                "flux": result.get("flux"), "r2": result.get("r2")}
+
+    def start_recording(self):
+        """Record the samples of the running continuous reading into a new session file"""
+        self.recording_closed.clear()
+        self.session_samples = 0
+        self.recording = True
+
+    def finish_recording(self):
+        """Close the session file without stopping the continuous reading, returns False if no file was closed"""
+        self.recording = False
+        # The reader notices at its next frame and the writer closes the file after the queued samples
+        return self.recording_closed.wait(timeout=2 * self.timeout + 1)
+
+    def stop_reading(self):
+        """Stop continuous reading, every sample already read is written before the file is closed"""
+        if self.is_reading:
+            self.is_reading = False
+            if self.read_thread:
+                # The reader wakes up at the latest after the serial timeout
+                self.read_thread.join(timeout=2 * self.timeout + 1)
+            if self.write_thread:
+                self.sample_queue.put(None)
+                self.write_thread.join()
+                self.write_thread = None
+            self.save_data_in_dataframe(finished = True)
+            print("Stopped continuous reading")
+    
+    def extract_co2_h2o(self,xml_data):
+        """
+        Extract CO2 and H2O values from XML data, excluding those inside <raw> tags.
+        
+        Args:
+            xml_data (str): XML string containing sensor data
+            
+        Returns:
+            tuple: (co2, h2o, cell pressure, cell temperature, air temperature, air humidity)
+        """
+        return self.frame_values(parse_frame(xml_data))
+
+    def frame_values(self,frame,arrival=None):
+        """Values of a parsed frame completed with the air sensor, in the order saved to file"""
+        co2_value, h2o_value, press_value, temp_value = frame.co2, frame.h2o, frame.cellpres, frame.celltemp
+
+        # Air temp from the reading of the I2C sensor thread closest to the frame arrival
+        if self.sensor:
+            temp_air, rel_hum_air = self.air_sampler.nearest(arrival)
+        else:
+            temp_air = MISSING_VALUE
+            rel_hum_air = MISSING_VALUE
+
+        return (co2_value, h2o_value, press_value, temp_value,temp_air,rel_hum_air)
+
+    def save_data_in_dataframe(self,values=None,finished = False,timestamp=None):
+        if finished == True:
+            if self.recorder.is_open:
+                self.recorder.close()
+                self.filename_exists=False
+                #self.filename = None
+                self.new_recording = True
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        if values[0] is not None and values[1] is not None:
+            if self.new_recording:
+                self.start_time = timestamp
+                self.buffer.clear()
+                self.flux.reset()
+                # The chamber settings let the catalog backfill compute the same flux as the live one
+                self.recorder.open("data/"+self.full_filename, metadata={"user": self.user, "filename": self.filename,
+                                                                         "start_time": self.start_time,
+                                                                         "volume": self.flux.volume, "area": self.flux.area,
+                                                                         "dead_band": self.flux.dead_band})
+            sample = (timestamp-self.start_time, values[0], values[1], values[2], values[3], values[4], values[5])
+            # Only the new record is appended to the session file, the csv is generated on download
+            self.recorder.write_row(sample)
+            self.buffer.append(sample, user=self.user)
+            self.flux.add(sample[0], values[0], values[2], values[3])
+            self.samples_recorded += 1
+            self.session_samples += 1
+            self.new_recording = False
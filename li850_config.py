@@ -0,0 +1,164 @@
+"""
+Output configuration of the Li-850 over its XML command interface.
+On connect the analyzer is asked for its settings, then told to output only the
+fields that are stored (no <raw> block) at the requested interval, and
+optionally to switch to a faster baud rate. Each command must be acknowledged
+with <ack>true</ack>. The saved settings are sent back on disconnect.
+
+    <li850>?</li850>                                      -> current settings
+    <li850><rs232><co2>true</co2>...<raw>false</raw></rs232></li850>  -> <li850><ack>true</ack></li850>
+    <li850><cfg><outrate>1</outrate></cfg></li850>        -> <li850><ack>true</ack></li850>
+"""
+
+import re
+import time
+
+# Fields the client stores, see Li_850_client.frame_values
+NEEDED_FIELDS = ("celltemp", "cellpres", "co2", "h2o")
+
+_ACK = re.compile(rb"<ack>(true|false)</ack>")
+_SECTION = {name: re.compile(rf"<{name}>(.*?)</{name}>".encode(), re.DOTALL) for name in ("rs232", "cfg")}
+_BOOLEAN = re.compile(rb"<(\w+)>(true|false)</\1>")
+_OUTRATE = re.compile(rb"<outrate>([^<]*)</outrate>")
+_BPS = re.compile(rb"<bps>([^<]*)</bps>")
+
+
+def rs232_command(fields):
+    """Output selection command, fields maps a field name to True or False"""
+    selection = "".join(f"<{name}>{'true' if enabled else 'false'}</{name}>" for name, enabled in fields.items())
+    return f"<li850><rs232>{selection}</rs232></li850>\n".encode('utf-8')
+
+
+def cfg_command(**settings):
+    """Configuration command, e.g. cfg_command(outrate=1)"""
+    values = "".join(f"<{name}>{value:g}</{name}>" if isinstance(value, float) else f"<{name}>{value}</{name}>"
+                     for name, value in settings.items())
+    return f"<li850><cfg>{values}</cfg></li850>\n".encode('utf-8')
+
+
+QUERY_COMMAND = b"<li850>?</li850>\n"
+
+
+def parse_settings(reply):
+    """Output selection, output interval and baud rate of a settings reply, None for what is missing"""
+    settings = {"rs232": None, "outrate": None, "bps": None}
+    rs232 = _SECTION["rs232"].search(reply)
+    if rs232 is not None:
+        settings["rs232"] = {name.decode(): value == b"true" for name, value in _BOOLEAN.findall(rs232.group(1))}
+    cfg = _SECTION["cfg"].search(reply)
+    if cfg is not None:
+        for name, pattern in (("outrate", _OUTRATE), ("bps", _BPS)):
+            match = pattern.search(cfg.group(1))
+            if match is not None:
+                try:
+                    settings[name] = float(match.group(1)) if name == "outrate" else int(match.group(1))
+                except ValueError:
+                    pass
+    return settings
+
+
+class ConfigError(Exception):
+    pass
+
+
+class AnalyzerConfigurator():
+    def __init__(self, serial_connection, reply_timeout=2.0):
+        self.serial_connection = serial_connection
+        self.reply_timeout = reply_timeout
+        self.original = None
+        self.original_baudrate = None
+        self.applied = False
+
+    def _reply(self, command, wanted):
+        """Send a command and return the first line matching wanted, skipping the data frames streamed meanwhile"""
+        self.serial_connection.write(command)
+        self.serial_connection.flush()
+        deadline = time.monotonic() + self.reply_timeout
+        while time.monotonic() < deadline:
+            line = self.serial_connection.read_until(b"\n", 4096).strip()
+            if not line:
+                continue
+            if line == command.strip():
+                raise ConfigError("The port echoes the commands, no analyzer is answering")
+            if wanted(line):
+                return line
+        raise ConfigError(f"No reply to {command.strip().decode('utf-8', 'replace')}")
+
+    def send(self, command):
+        """Send a configuration command, raises ConfigError unless it is acknowledged"""
+        match = _ACK.search(self._reply(command, _ACK.search))
+        if match.group(1) != b"true":
+            raise ConfigError(f"Command refused: {command.strip().decode('utf-8', 'replace')}")
+
+    def query(self):
+        reply = self._reply(QUERY_COMMAND, lambda line: b"<rs232>" in line or b"<cfg>" in line)
+        return parse_settings(reply)
+
+    def apply(self, fields=NEEDED_FIELDS, outrate=None, baudrate=None):
+        """
+        Save the current settings, then select the output fields, interval (s) and baud rate.
+        Raises ConfigError if the analyzer does not answer, refuses a command or its output
+        selection cannot be read, nothing is changed in that last case.
+        """
+        self.original = self.query()
+        self.original_baudrate = self.serial_connection.baudrate
+        if not self.original["rs232"]:
+            # A selection that cannot be sent back on disconnect is not changed
+            raise ConfigError("The current output selection could not be read")
+        # Every field the analyzer reported is switched off unless it is needed
+        selection = {name: name in fields for name in self.original["rs232"]}
+        self.applied = True
+        self.send(rs232_command(selection))
+        if outrate is not None:
+            self.send(cfg_command(outrate=float(outrate)))
+        if baudrate is not None and baudrate != self.serial_connection.baudrate:
+            self._set_baudrate(baudrate)
+
+    def _set_baudrate(self, baudrate):
+        previous = self.serial_connection.baudrate
+        # The analyzer acknowledges at the current rate and switches after
+        self.send(cfg_command(bps=baudrate))
+        self.serial_connection.baudrate = baudrate
+        if self._answers():
+            return
+        # It may not have switched, check at the previous rate before going back to it
+        self.serial_connection.baudrate = previous
+        if self._answers():
+            raise ConfigError(f"The analyzer stayed at {previous} baud")
+        # Heard at neither rate: keep the rate it acknowledged, restore() asks it to switch back
+        self.serial_connection.baudrate = baudrate
+        raise ConfigError(f"No reply at {baudrate} or {previous} baud, staying at {baudrate} baud")
+
+    def _answers(self):
+        try:
+            self.query()
+            return True
+        except ConfigError:
+            return False
+
+    def restore(self):
+        """Send back the settings saved by apply(), every command is tried even if one fails"""
+        if not self.applied or self.original is None:
+            return
+        self.applied = False
+        commands = []
+        if self.original["rs232"]:
+            commands.append(rs232_command(self.original["rs232"]))
+        if self.original["outrate"] is not None:
+            commands.append(cfg_command(outrate=self.original["outrate"]))
+        errors = []
+        for command in commands:
+            try:
+                self.send(command)
+            except ConfigError as e:
+                errors.append(str(e))
+        if self.serial_connection.baudrate != self.original_baudrate:
+            # Last, the other commands are answered at the current rate. The host follows only if
+            # the analyzer acknowledged, it does not switch otherwise
+            try:
+                self.send(cfg_command(bps=self.original_baudrate))
+                self.serial_connection.baudrate = self.original_baudrate
+            except ConfigError as e:
+                errors.append(str(e))
+        if errors:
+            raise ConfigError("; ".join(errors))
@@ -0,0 +1,46 @@
+"""
+Single pass parser for the <li850> XML frames streamed by the analyzer.
+Example of a frame:
+<li850><data><celltemp>5.1e1</celltemp><cellpres>9.7e1</cellpres><co2>4.1e2</co2><co2abs>6.7e-2</co2abs>
+<h2o>1.9e1</h2o><h2oabs>6.2e-2</h2oabs><ivolt>1.6e1</ivolt><flowrate>1.0</flowrate>
+<raw><co2>3379142</co2><co2ref>3765760</co2ref><h2o>2779434</h2o><h2oref>3161170</h2oref></raw></data></li850>
+"""
+
+import re
+from collections import namedtuple
+
+FIELDS = ["co2", "h2o", "cellpres", "celltemp", "ivolt", "flowrate", "co2abs", "h2oabs",
+          "raw_co2", "raw_co2ref", "raw_h2o", "raw_h2oref"]
+
+Li850Frame = namedtuple("Li850Frame", FIELDS + ["complete"])
+
+# One alternation so the whole line is scanned once: a leaf tag with its value or entering/leaving <raw>
+_TOKEN_RE = re.compile(r'<(\w+)>([^<]*)</\1>|<(/?raw)>')
+
+_TOP_INDEX = {name: i for i, name in enumerate(FIELDS) if not name.startswith("raw_")}
+_TOP_INDEX["flow"] = FIELDS.index("flowrate")
+_RAW_INDEX = {name[4:]: i for i, name in enumerate(FIELDS) if name.startswith("raw_")}
+
+
+def parse_frame(line):
+    """
+    Decode one frame into a Li850Frame.
+    Missing tags or values that are not numbers are left to None so partial
+    or garbled frames never raise.
+    """
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode('utf-8', errors='replace')
+    values = [None] * len(FIELDS)
+    field_index = _TOP_INDEX
+    for tag, value, raw_marker in _TOKEN_RE.findall(line):
+        if raw_marker:
+            field_index = _RAW_INDEX if raw_marker == "raw" else _TOP_INDEX
+            continue
+        index = field_index.get(tag)
+        if index is not None:
+            try:
+                values[index] = float(value)
+            except ValueError:
+                pass
+    complete = line.startswith("<li850>") and line.endswith("</li850>")
+    return Li850Frame(*values, complete=complete)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Simulated Li-850 analyzer on a pseudo terminal.
+Streams realistic <li850> frames at a configurable rate with noise, and can
+inject garbage lines and frames with dropped bytes. Connect the web interface
+or a Li_850_client to the port printed at startup.
+Answers the XML configuration commands like the analyzer: <li850>?</li850>
+returns the settings, <rs232> selects the output fields and <cfg> sets the
+output interval (<outrate>) and baud rate (<bps>), each acknowledged with <ack>.
+Usage: python li850_simulator.py --rate 1 --garbage 0.01 --drop 0.01
+"""
+
+import argparse
+import math
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+# Output fields in the order of the analyzer frames
+FIELDS = ("celltemp", "cellpres", "co2", "co2abs", "h2o", "h2oabs", "h2odewpoint", "ivolt", "flowrate", "raw")
+_SECTION = re.compile(r"<(\w+)>(.*?)</\1>", re.DOTALL)
+_SETTING = re.compile(r"<(\w+)>([^<]*)</\1>")
+
+
+class Li850Simulator():
+    def __init__(self, rate=1.0, co2_start=415.0, co2_slope=0.5, noise=0.3, garbage_rate=0.0,
+                 drop_rate=0.0, seed=None):
+        self.rate = rate
+        self.co2_start = co2_start
+        self.co2_slope = co2_slope
+        self.noise = noise
+        self.garbage_rate = garbage_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.port = None
+        self.frames_sent = 0
+        self.garbage_sent = 0
+        self.dropped_sent = 0
+        self.bytes_sent = 0
+        self.overflow_frames = 0
+        self.fields = {name: name != "flowrate" for name in FIELDS}
+        self.baudrate = 9600
+        self.commands_received = 0
+        self.commands_refused = 0
+        self._commands = bytearray()
+        self._master = None
+        self._slave = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Open the pseudo terminal and start streaming, returns the port to connect to"""
+        self._master, self._slave = os.openpty()
+        # Raw mode so the line discipline does not echo or translate the frames
+        tty.setraw(self._slave)
+        # The analyzer does not wait for the reader: frames that do not fit in the pty buffer are lost
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def frame(self, index):
+        """One frame as the analyzer would send it, index is the number of frames since start"""
+        t = index / self.rate
+        gauss = self.random.gauss
+        co2 = self.co2_start + self.co2_slope * t + gauss(0, self.noise)
+        h2o = 19.7 + 0.002 * t + gauss(0, 0.05)
+        celltemp = 51.4 + gauss(0, 0.01)
+        cellpres = 97.47 + 0.05 * math.sin(t / 60) + gauss(0, 0.005)
+        co2abs = 0.0678 * co2 / 412.0
+        raw_co2 = int(3765760 * (1 - co2abs))
+        values = {"celltemp": celltemp, "cellpres": cellpres, "co2": co2, "co2abs": co2abs, "h2o": h2o,
+                  "h2oabs": 6.2136013e-2, "h2odewpoint": 17.32, "ivolt": 16.14 + gauss(0, 0.01), "flowrate": 0.5}
+        # Only the fields selected with <rs232> are sent
+        data = "".join(f"<{name}>{values[name]:.7e}</{name}>" for name in FIELDS[:-1] if self.fields[name])
+        if self.fields["raw"]:
+            data += (f"<raw><co2>{raw_co2}</co2><co2ref>3765760</co2ref>"
+                     f"<h2o>2779434</h2o><h2oref>3161170</h2oref></raw>")
+        return f"<li850><data>{data}</data></li850>"
+
+    def settings(self):
+        """Reply to <li850>?</li850>"""
+        selection = "".join(f"<{name}>{'true' if enabled else 'false'}</{name}>" for name, enabled in self.fields.items())
+        return (f"<li850><ver>1.0.0</ver><cfg><outrate>{1 / self.rate:g}</outrate><bps>{self.baudrate}</bps></cfg>"
+                f"<rs232>{selection}</rs232></li850>")
+
+    def respond(self, command):
+        """Reply to one command, the text between <li850> and </li850>"""
+        self.commands_received += 1
+        if command.strip() == "?":
+            return self.settings()
+        accepted = True
+        for section, body in _SECTION.findall(command):
+            if section == "rs232":
+                for name, value in _SETTING.findall(body):
+                    if name in self.fields and value in ("true", "false"):
+                        self.fields[name] = value == "true"
+                    else:
+                        accepted = False
+            elif section == "cfg":
+                for name, value in _SETTING.findall(body):
+                    try:
+                        if name == "outrate" and float(value) > 0:
+                            self.rate = 1 / float(value)
+                        elif name == "bps" and int(value) > 0:
+                            # A pty has no line speed, the new rate is only reported
+                            self.baudrate = int(value)
+                        else:
+                            accepted = False
+                    except ValueError:
+                        accepted = False
+            else:
+                accepted = False
+        if not accepted:
+            self.commands_refused += 1
+        return f"<li850><ack>{'true' if accepted else 'false'}</ack></li850>"
+
+    def _read_commands(self, timeout):
+        """Wait up to timeout for commands from the client and answer them"""
+        readable, _, _ = select.select([self._master], [], [], timeout)
+        if not readable:
+            return
+        try:
+            self._commands += os.read(self._master, 4096)
+        except BlockingIOError:
+            return
+        while b"</li850>" in self._commands:
+            end = self._commands.index(b"</li850>") + len(b"</li850>")
+            command = self._commands[:end].decode('utf-8', 'replace')
+            del self._commands[:end]
+            start = command.find("<li850>")
+            if start >= 0:
+                self._write(self.respond(command[start + len("<li850>"):-len("</li850>")]).encode('utf-8') + b"\n")
+        if len(self._commands) > 4096:
+            self._commands.clear()
+
+    def next_bytes(self, index):
+        """Bytes to send for one frame, possibly corrupted"""
+        roll = self.random.random()
+        if roll < self.garbage_rate:
+            self.garbage_sent += 1
+            return bytes(self.random.randrange(256) for _ in range(self.random.randrange(1, 80))) + b"\n"
+        data = self.frame(index).encode('utf-8')
+        if roll < self.garbage_rate + self.drop_rate:
+            self.dropped_sent += 1
+            start = self.random.randrange(len(data))
+            data = data[:start] + data[start + self.random.randrange(1, 40):]
+        return data + b"\n"
+
+    def _write(self, data):
+        try:
+            written = os.write(self._master, data)
+            self.bytes_sent += written
+            if written < len(data):
+                self.overflow_frames += 1
+        except BlockingIOError:
+            self.overflow_frames += 1
+
+    def _run(self):
+        index = 0
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            if time.monotonic() >= next_time:
+                try:
+                    self._write(self.next_bytes(index))
+                except OSError:
+                    break
+                self.frames_sent += 1
+                index += 1
+                next_time += 1 / self.rate
+            # Commands are answered between the frames, the short wait keeps stop() responsive
+            try:
+                self._read_commands(min(max(0.0, next_time - time.monotonic()), 0.1))
+            except OSError:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Li-850 analyzer on a pseudo terminal")
+    parser.add_argument("--rate", type=float, default=1.0, help="frames per second")
+    parser.add_argument("--slope", type=float, default=0.5, help="CO2 increase in ppm/s")
+    parser.add_argument("--noise", type=float, default=0.3, help="CO2 noise standard deviation in ppm")
+    parser.add_argument("--garbage", type=float, default=0.0, help="fraction of garbage lines")
+    parser.add_argument("--drop", type=float, default=0.0, help="fraction of frames with dropped bytes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = Li850Simulator(rate=args.rate, co2_slope=args.slope, noise=args.noise,
+                               garbage_rate=args.garbage, drop_rate=args.drop, seed=args.seed)
+    port = simulator.start()
+    print(port, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nExiting...")
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
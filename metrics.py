@@ -0,0 +1,73 @@
+"""
+Metrics of the acquisition pipeline in the Prometheus text format.
+The hot path only updates plain counters and LatencyStats on the objects that
+already exist (FrameReader, recorders, sampler...). Collectors registered here
+read them when /metrics is scraped, so leaving the metrics on costs nothing
+between scrapes.
+"""
+
+import asyncio
+import time
+
+from serial_reader import LatencyStats
+
+
+class Metrics():
+    def __init__(self, prefix="li850_"):
+        self.prefix = prefix
+        self.collectors = []
+
+    def register(self, collector):
+        """collector() yields (name, type, help, value, labels dict) tuples"""
+        self.collectors.append(collector)
+        return collector
+
+    def samples(self):
+        for collector in self.collectors:
+            try:
+                yield from collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+
+    def render(self):
+        # Samples of one metric must be contiguous, they are grouped by name in order of first appearance
+        families = {}
+        for name, kind, help_text, value, labels in self.samples():
+            if value is None:
+                continue
+            family = families.setdefault(self.prefix + name, (kind, help_text, []))
+            family[2].append((labels, value))
+        lines = []
+        for name, (kind, help_text, values) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                value_text = str(value) if isinstance(value, int) else f"{float(value):.6g}"
+                if labels:
+                    label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value_text}")
+                else:
+                    lines.append(f"{name} {value_text}")
+        return "\n".join(lines) + "\n"
+
+
+def latency_samples(name, help_text, stats, labels=None):
+    """Expand a LatencyStats into mean, max, last and count samples"""
+    labels = labels or {}
+    yield name + "_seconds_mean", "gauge", help_text + " (smoothed mean)", stats.mean, labels
+    yield name + "_seconds_max", "gauge", help_text + " (max)", stats.max, labels
+    yield name + "_seconds_last", "gauge", help_text + " (last)", stats.last, labels
+    yield name + "_total", "counter", help_text + " (count)", stats.count, labels
+
+
+class EventLoopLag():
+    """Measures how late the event loop wakes up a sleeping task"""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = LatencyStats()
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag.add(max(0.0, time.monotonic() - start - self.interval))
@@ -0,0 +1,65 @@
+"""
+Cached network status (SSID and IP address) refreshed off the UI event loop.
+A background thread watches /proc/net/route and /proc/net/wireless, which are
+cheap to read, and only runs iwgetid and the socket lookup when they changed
+or when the cached values are older than the TTL.
+"""
+
+import threading
+import time
+
+from display_oled import get_ssid, get_local_ip
+
+
+class NetworkStatus():
+    def __init__(self, ttl=60.0, check_interval=2.0):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.ssid = "Not connected"
+        self.ip_address = "Not connected"
+        self.refreshes = 0
+        self.last_refresh = None
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            signature = self._read_signature()
+            expired = self.last_refresh is None or time.monotonic() - self.last_refresh > self.ttl
+            if signature != self._signature or expired:
+                self.refresh()
+                self._signature = signature
+            self._stop.wait(self.check_interval)
+
+    def refresh(self):
+        self.ssid = get_ssid()
+        self.ip_address = get_local_ip()
+        self.refreshes += 1
+        self.last_refresh = time.monotonic()
+
+    @staticmethod
+    def _read_signature():
+        """Routing table and wireless interfaces with their status, ignoring the link quality counters"""
+        signature = []
+        try:
+            with open("/proc/net/route", "r") as f:
+                signature.append(tuple(f.readlines()[1:]))
+        except OSError:
+            signature.append(None)
+        try:
+            with open("/proc/net/wireless", "r") as f:
+                signature.append(tuple(tuple(line.split()[:2]) for line in f.readlines()[2:]))
+        except OSError:
+            signature.append(None)
+        return tuple(signature)
@@ -0,0 +1,89 @@
+"""
+Incremental updates of the real time plot.
+Only the points added since the last push are sent to the browser. When the
+number of points shown grows past twice the window, the whole run is sent
+again downsampled with LTTB to max_points so the payload stays bounded on long runs.
+"""
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling, returns two lists of at most threshold points"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(x), list(y)
+    sampled_x = [x[0]]
+    sampled_y = [y[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(x[next_start:next_end]) / count
+        avg_y = sum(y[next_start:next_end]) / count
+        # Point of the current bucket making the largest triangle with the previous pick and the average
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = x[a], y[a]
+        max_area = -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a_next = j
+        sampled_x.append(x[a_next])
+        sampled_y.append(y[a_next])
+        a = a_next
+    sampled_x.append(x[n - 1])
+    sampled_y.append(y[n - 1])
+    return sampled_x, sampled_y
+
+
+class PlotStream():
+    def __init__(self, x_channel="elapsed_time", y_channel="CO2_ppm", max_points=500, decimals=2):
+        self.x_channel = x_channel
+        self.y_channel = y_channel
+        self.max_points = max_points
+        self.decimals = decimals
+        self.generation = None
+        self.sent = 0
+        self.shown = 0
+        self.full_pushes = 0
+        self.extend_pushes = 0
+        self.bytes_pushed = 0
+        self.last_payload = 0
+
+    def next_update(self, buffer):
+        """
+        Points to send for the current state of the buffer.
+
+        Returns:
+            tuple: ("full", x, y) to replace the trace, ("extend", x, y) to append to it, or None
+        """
+        # One snapshot so x and y have the same length while the writer thread appends
+        generation, (x, y) = buffer.snapshot(self.x_channel, self.y_channel)
+        n = len(x)
+        new_session = generation != self.generation
+        if n == 0 or (n == self.sent and not new_session):
+            return None
+        if new_session or self.shown + n - self.sent > 2 * self.max_points:
+            self.generation = generation
+            full_x, full_y = lttb(x, y, self.max_points)
+            self.sent = n
+            self.shown = len(full_x)
+            self.full_pushes += 1
+            return "full", self._round(full_x), self._round(full_y)
+        new_x, new_y = x[self.sent:n].tolist(), y[self.sent:n].tolist()
+        self.shown += n - self.sent
+        self.sent = n
+        self.extend_pushes += 1
+        return "extend", self._round(new_x), self._round(new_y)
+
+    def record_payload(self, size):
+        """Size in bytes of the update that was sent to the browser"""
+        self.last_payload = size
+        self.bytes_pushed += size
+
+    def _round(self, values):
+        return [round(v, self.decimals) for v in values]
@@ -0,0 +1,103 @@
+"""
+Append-only recorder for Li-850 measurement sessions, and the CSV formatting of the exports.
+The file is opened once, the header written, then one record is appended per sample.
+Rows are flushed and fsynced on a configurable cadence so a power loss
+only loses the samples written since the last sync.
+"""
+
+import os
+import time
+
+from serial_reader import LatencyStats
+
+
+class Recorder():
+    """
+    Append-only session file. Subclasses give the bytes of the header and of a record,
+    see SessionWriter in session_store.py.
+    """
+    def __init__(self, columns, fsync_rows=10, fsync_interval=5.0):
+        self.columns = list(columns)
+        self.fsync_rows = fsync_rows
+        self.fsync_interval = fsync_interval
+        self.path = None
+        self.file = None
+        self.rows = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        self.metadata = {}
+        self.write_time = LatencyStats()
+        self._unsynced_rows = 0
+        self._last_sync = 0.0
+
+    @property
+    def is_open(self):
+        return self.file is not None
+
+    def open(self, path, metadata=None):
+        """Create the file, write the header and sync it to disk"""
+        if self.file is not None:
+            self.close()
+        self.path = path
+        self.file = open(path, "wb", buffering=64 * 1024)
+        self.rows = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        self.metadata = metadata or {}
+        self._write(self._header())
+        self.flush(sync=True)
+
+    def write_row(self, values):
+        """Append one sample, values are given in the same order as the columns"""
+        if self.file is None:
+            raise ValueError("Recorder is not open")
+        start = time.perf_counter()
+        self._write(self._row(values))
+        self.rows += 1
+        self._unsynced_rows += 1
+        if self._unsynced_rows >= self.fsync_rows or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.flush(sync=True)
+        self.write_time.add(time.perf_counter() - start)
+
+    def flush(self, sync=True):
+        """Push buffered rows to the OS and optionally to the SD card"""
+        if self.file is None:
+            return
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+            self.syncs += 1
+        self._unsynced_rows = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Sync the last rows and close the file"""
+        if self.file is None:
+            return
+        self.flush(sync=True)
+        self.file.close()
+        self.file = None
+
+    def _header(self):
+        raise NotImplementedError
+
+    def _row(self, values):
+        raise NotImplementedError
+
+    def _write(self, data):
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+
+def format_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        if any(c in value for c in ',"\n\r'):
+            return '"' + value.replace('"', '""') + '"'
+        return value
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_csv_row(values):
+    return ",".join(format_csv_value(v) for v in values) + "\n"
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Recompute the fluxes of archived sessions with new chamber or fit parameters.
+Reads the .li850 session files and the csv files of the previous versions
+(same columns as save_data_in_dataframe), fits CO2 against elapsed time with
+vectorized least squares in a pool of processes and writes one summary table.
+Results are cached by file content hash and parameters, so a rerun only
+computes the files that changed.
+Usage: python reprocess.py data --volume 4.2 --area 317.8 --dead-band 30 --window 120 -o summary.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from flux import R, DEFAULT_VOLUME, DEFAULT_AREA, DEFAULT_DEAD_BAND
+from recorder import format_csv_row
+from session_catalog import SessionCatalog, split_filename, process_pool_context
+from session_store import SessionReader, EXTENSION, file_hash
+
+CACHE_VERSION = 1
+COLUMNS = ["elapsed_time", "CO2_ppm", "Cell_pressure", "Cell_temp"]
+SUMMARY_FIELDS = ["path", "collar", "user", "start_time", "samples", "n", "slope", "intercept", "r2",
+                  "flux", "slope_exp", "r2_exp", "flux_exp", "volume", "area", "dead_band", "window"]
+
+
+def load_session(path):
+    """Columns needed for the fit as float64 arrays, and the user of the session"""
+    if path.endswith(EXTENSION):
+        with SessionReader(path) as session:
+            records = session.to_numpy()
+            # Copied out of the memory map before it is closed
+            columns = {name: np.array(records[name]) for name in COLUMNS if name in session.columns}
+            del records
+            return columns, session.header.get("user")
+    with open(path, "r", newline="") as f:
+        header = next(csv.reader(f), [])
+        indices = {name: header.index(name) for name in COLUMNS if name in header}
+        user_index = header.index("user") if "user" in header else None
+        first = next(csv.reader(f), None)
+        user = first[user_index] if first is not None and user_index is not None and user_index < len(first) else None
+    if not indices or first is None:
+        # No column to fit or header only, the session was cut short before its first sample
+        return {}, user
+    data = np.genfromtxt(path, delimiter=",", skip_header=1, usecols=list(indices.values()),
+                         dtype=np.float64, invalid_raise=False, ndmin=2)
+    if data.size == 0 or data.shape[1] < len(indices):
+        return {}, user
+    return {name: data[:, i] for i, name in enumerate(indices)}, user
+
+
+def linear_fit(x, y):
+    """Least squares y = a + b x on arrays, returns (slope, intercept, r2) or None"""
+    n = x.size
+    if n < 3:
+        return None
+    x_mean, y_mean = x.mean(), y.mean()
+    dx, dy = x - x_mean, y - y_mean
+    sxx, syy, sxy = np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy)
+    if sxx <= 0:
+        return None
+    slope = sxy / sxx
+    r2 = sxy * sxy / (sxx * syy) if syy > 0 else 1.0
+    return float(slope), float(y_mean - slope * x_mean), float(r2)
+
+
+def compute_flux(columns, volume=DEFAULT_VOLUME, area=DEFAULT_AREA, dead_band=DEFAULT_DEAD_BAND, window=None):
+    """
+    Linear and exponential fit of the samples after the dead band, as FluxEngine without window.
+    window limits the fit to the first window seconds after the dead band, unlike FluxEngine.window
+    which slides over the last seconds of the live session.
+    """
+    t = columns.get("elapsed_time")
+    co2 = columns.get("CO2_ppm")
+    result = {"samples": 0 if t is None else int(t.size), "n": 0}
+    if t is None or co2 is None:
+        return result
+    mask = np.isfinite(t) & np.isfinite(co2) & (t >= dead_band)
+    if window is not None:
+        mask &= t <= dead_band + window
+    t, co2 = t[mask], co2[mask]
+    result["n"] = int(t.size)
+    fit = linear_fit(t, co2)
+    if fit is None:
+        return result
+    result["slope"], result["intercept"], result["r2"] = fit
+    factor = _conversion_factor(columns, mask, volume, area)
+    if factor is not None:
+        result["flux"] = result["slope"] * factor
+    positive = co2 > 0
+    log_fit = linear_fit(t[positive], np.log(co2[positive]))
+    if log_fit is not None and factor is not None:
+        # C = C0 exp(k t): initial rate at the first fitted sample is k * C(t0)
+        k, ln_c0, r2_exp = log_fit
+        result["slope_exp"] = k * float(np.exp(ln_c0 + k * t[positive][0]))
+        result["flux_exp"] = result["slope_exp"] * factor
+        result["r2_exp"] = r2_exp
+    return result
+
+
+def _conversion_factor(columns, mask, volume, area):
+    pressure = columns.get("Cell_pressure")
+    temperature = columns.get("Cell_temp")
+    if pressure is None or temperature is None or not area:
+        return None
+    pressure, temperature = pressure[mask], temperature[mask]
+    pressure = pressure[np.isfinite(pressure)]
+    temperature = temperature[np.isfinite(temperature)]
+    if pressure.size == 0 or temperature.size == 0:
+        return None
+    return float(1000 * pressure.mean() * (volume / 1000) / (R * (273.15 + temperature.mean()) * area / 10000))
+
+
+def cache_key(content_hash, parameters):
+    text = json.dumps({"version": CACHE_VERSION, "parameters": parameters}, sort_keys=True)
+    return content_hash + "_" + hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def process_file(path, parameters, cache_dir=None):
+    """Summary row of one session, from the cache when the file and parameters did not change"""
+    try:
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, cache_key(file_hash(path), parameters) + ".json")
+            try:
+                with open(cache_path, "r") as f:
+                    row = json.load(f)
+                row["path"] = path
+                return row, True
+            except (OSError, ValueError):
+                pass
+        collar, start_time = split_filename(path)
+        columns, user = load_session(path)
+        row = {"path": path, "collar": collar, "user": user, "start_time": start_time}
+        row.update(compute_flux(columns, **parameters))
+    except Exception as e:
+        # One missing or unreadable file must not stop the whole batch
+        print(f"Unable to process {path}: {e}", file=sys.stderr)
+        return None, False
+    row.update(parameters)
+    if cache_path is not None:
+        with open(cache_path + ".tmp", "w") as f:
+            json.dump(row, f)
+        os.replace(cache_path + ".tmp", cache_path)
+    return row, False
+
+
+def _process(task):
+    return process_file(*task)
+
+
+def session_paths(inputs):
+    """Session files of the given files and directories"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(SessionCatalog.session_files(item))
+        else:
+            paths.append(item)
+    return paths
+
+
+def reprocess(paths, parameters, cache_dir=None, workers=None):
+    """Summary rows of all the sessions in the input order, and the number taken from the cache"""
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    tasks = [(path, parameters, cache_dir) for path in paths]
+    if workers == 1:
+        results = list(map(_process, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as pool:
+            chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+            results = list(pool.map(_process, tasks, chunksize=chunksize))
+    rows = [row for row, _ in results if row is not None]
+    cached = sum(1 for _, hit in results if hit)
+    return rows, cached
+
+
+def write_summary(rows, out):
+    out.write(format_csv_row(SUMMARY_FIELDS))
+    for row in rows:
+        out.write(format_csv_row([row.get(field) for field in SUMMARY_FIELDS]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the fluxes of archived Li-850 sessions")
+    parser.add_argument("inputs", nargs="*", default=["data"], help="session files or directories (default: data)")
+    parser.add_argument("--volume", type=float, default=DEFAULT_VOLUME, help="chamber + tubing volume in L")
+    parser.add_argument("--area", type=float, default=DEFAULT_AREA, help="collar area in cm2")
+    parser.add_argument("--dead-band", type=float, default=DEFAULT_DEAD_BAND, help="seconds ignored after closure")
+    parser.add_argument("--window", type=float, default=None,
+                        help="fit only the first seconds after the dead band (default: all), "
+                             "not the sliding window of the live flux")
+    parser.add_argument("-o", "--output", default="-", help="summary csv file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--cache", default=os.path.join("data", ".reprocess_cache"), help="cache directory")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    parameters = {"volume": args.volume, "area": args.area, "dead_band": args.dead_band, "window": args.window}
+    paths = session_paths(args.inputs)
+    start = time.perf_counter()
+    rows, cached = reprocess(paths, parameters, cache_dir=None if args.no_cache else args.cache, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    if args.output == "-":
+        write_summary(rows, sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            write_summary(rows, f)
+    print(f"{len(rows)} sessions ({cached} from cache) in {elapsed:.2f} s, "
+          f"{len(rows) / elapsed if elapsed > 0 else 0:.1f} sessions/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
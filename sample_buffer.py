@@ -0,0 +1,104 @@
+"""
+Compact columnar buffer for the samples of a measurement session.
+Each channel is stored in its own typed array and the user names are interned,
+so appending a sample does not allocate a new python object per value.
+The writer thread appends while the UI reads, both go through a short lock and
+the arrays are never resized in place, so a snapshot stays valid after later appends.
+"""
+
+import threading
+from array import array
+
+CHANNELS = ["elapsed_time", "CO2_ppm", "H2O", "Cell_pressure", "Cell_temp", "Air_temp", "Rel_hum_air"]
+
+
+class SampleBuffer():
+    def __init__(self, channels=CHANNELS, capacity=3600):
+        self.channels = list(channels)
+        self.capacity = capacity
+        self.users = []
+        self._user_codes = {}
+        self._lock = threading.Lock()
+        self.generation = -1
+        self.clear()
+
+    def clear(self):
+        """Drop all samples but keep the interned user table"""
+        with self._lock:
+            self.length = 0
+            self.generation += 1
+            self._allocate(self.capacity)
+
+    def __len__(self):
+        return self.length
+
+    def append(self, values, user=None):
+        """Append one sample, values are given in the order of the channels"""
+        code = self.intern_user(user)
+        with self._lock:
+            if self.length == len(self._user):
+                self._grow()
+            i = self.length
+            for column, value in zip(self._columns, values):
+                column[i] = float("nan") if value is None else value
+            self._user[i] = code
+            self.length = i + 1
+
+    def intern_user(self, user):
+        code = self._user_codes.get(user)
+        if code is None:
+            code = len(self.users)
+            self._user_codes[user] = code
+            self.users.append(user)
+        return code
+
+    def view(self, channel):
+        """Zero-copy view on the filled part of one channel"""
+        return self.snapshot(channel)[1][0]
+
+    def snapshot(self, *channels):
+        """
+        Consistent zero-copy views of several channels.
+
+        Returns:
+            tuple: (generation, [views]) all views having the same length
+        """
+        with self._lock:
+            return self.generation, [memoryview(self._columns[self.channels.index(c)])[:self.length] for c in channels]
+
+    def user_codes(self):
+        with self._lock:
+            return memoryview(self._user)[:self.length]
+
+    def last(self, channel):
+        with self._lock:
+            if self.length == 0:
+                return None
+            return self._columns[self.channels.index(channel)][self.length - 1]
+
+    def nbytes(self):
+        """Memory used by the preallocated arrays"""
+        return sum(c.itemsize * len(c) for c in self._columns) + self._user.itemsize * len(self._user)
+
+    def to_dataframe(self):
+        """Build a pandas DataFrame with the same columns as the recorded csv"""
+        import pandas as pd
+        with self._lock:
+            n = self.length
+            data = {channel: memoryview(column)[:n] for channel, column in zip(self.channels, self._columns)}
+            data["user"] = [self.users[code] for code in self._user[:n]]
+        return pd.DataFrame(data)
+
+    def _allocate(self, capacity):
+        self._columns = [array('d', bytes(8 * capacity)) for _ in self.channels]
+        self._user = array('H', bytes(2 * capacity))
+
+    def _grow(self):
+        # New arrays are allocated instead of resizing in place so views
+        # handed out before the growth stay valid
+        n = self.length
+        old_columns, old_user = self._columns, self._user
+        self._allocate(max(2 * n, 16))
+        for new, old in zip(self._columns, old_columns):
+            new[:n] = old[:n]
+        self._user[:n] = old_user[:n]
@@ -0,0 +1,91 @@
+"""
+Publish/subscribe of the live samples to the connected viewers.
+The reader threads publish each parsed sample once: it is serialized to JSON a
+single time and the same payload is queued for every subscriber. Each
+subscriber has a bounded queue, when a slow client falls behind the oldest
+samples are dropped (coalesced) so it always receives the most recent ones.
+"""
+
+import asyncio
+import json
+from collections import deque
+
+
+class Subscriber():
+    def __init__(self, maxsize=50, filter=None):
+        self.queue = deque(maxlen=maxsize)
+        self.filter = filter
+        self.coalesced = 0
+        self.delivered = 0
+        self.closed = False
+        self._event = asyncio.Event()
+
+    def put(self, topic, payload):
+        if self.filter is not None and topic != self.filter:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.coalesced += 1
+        self.queue.append(payload)
+        self._event.set()
+
+    def close(self):
+        """Wake the consumer waiting in get_batch, even if no sample arrives anymore"""
+        self.closed = True
+        self._event.set()
+
+    async def get_batch(self):
+        """Wait for samples and return all the pending payloads, an empty batch once closed"""
+        while not self.queue and not self.closed:
+            self._event.clear()
+            await self._event.wait()
+        batch = list(self.queue)
+        self.queue.clear()
+        self.delivered += len(batch)
+        return batch
+
+
+class SampleBus():
+    def __init__(self):
+        self.loop = None
+        self.subscribers = set()
+        self.published = 0
+        self.bytes_serialized = 0
+
+    def attach_loop(self, loop):
+        """Event loop of the web server, samples published before are ignored"""
+        self.loop = loop
+
+    def publish(self, topic, sample):
+        """Called from the reader threads, the sample is serialized here once for all subscribers"""
+        if self.loop is None or not self.subscribers:
+            return
+        payload = json.dumps(sample, separators=(",", ":"))
+        self.published += 1
+        self.bytes_serialized += len(payload)
+        self.loop.call_soon_threadsafe(self._dispatch, topic, payload)
+
+    def _dispatch(self, topic, payload):
+        for subscriber in tuple(self.subscribers):
+            subscriber.put(topic, payload)
+
+    def subscribe(self, maxsize=50, topic=None):
+        subscriber = Subscriber(maxsize=maxsize, filter=topic)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def queue_depths(self):
+        return [len(subscriber.queue) for subscriber in tuple(self.subscribers)]
+
+    async def sse(self, topic=None, maxsize=50):
+        """Server-sent events stream of the samples, one event per batch of pending samples"""
+        subscriber = self.subscribe(maxsize=maxsize, topic=topic)
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                batch = await subscriber.get_batch()
+                yield "".join(f"data: {payload}\n\n" for payload in batch)
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,201 @@
+"""
+Automatic survey of a list of collars with one analyzer.
+The scheduler follows the live CO2 trend: a steady rise means the chamber was
+closed on the collar and the recording starts, after the collar duration the
+recording stops, and a sharp drop (or the CO2 back to its level before the
+closure) means the chamber was opened and the next collar is armed. The
+scheduler only decides, the caller applies the returned actions.
+
+The collar list is read from config_filenames.ini, a line can give the
+duration and dead band of the collar in seconds:
+
+    B1N10, 180, 30
+"""
+
+import time
+from collections import deque, namedtuple
+
+from flux import IncrementalRegression, DEFAULT_DEAD_BAND
+
+DEFAULT_DURATION = 120.0  # s
+
+Collar = namedtuple("Collar", ["name", "duration", "dead_band"])
+
+WAIT_CLOSE = "waiting for closure"
+RECORDING = "recording"
+WAIT_OPEN = "waiting for opening"
+DONE = "done"
+
+
+def read_schedule(path="config_filenames.ini", duration=DEFAULT_DURATION, dead_band=DEFAULT_DEAD_BAND):
+    """Collars of the config file with their duration and dead band, the defaults when not given"""
+    schedule = []
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except OSError:
+        print("No filename config file found")
+        return schedule
+    for line in lines:
+        fields = [field.strip() for field in line.split(",")]
+        if not fields[0]:
+            continue
+        try:
+            collar_duration = float(fields[1]) if len(fields) > 1 and fields[1] else duration
+            collar_dead_band = float(fields[2]) if len(fields) > 2 and fields[2] else dead_band
+        except ValueError:
+            print(f"Invalid duration or dead band for {fields[0]}, using the defaults")
+            collar_duration, collar_dead_band = duration, dead_band
+        schedule.append(Collar(fields[0], collar_duration, collar_dead_band))
+    return schedule
+
+
+class TrendDetector():
+    """Slope of the CO2 over a sliding time window"""
+    def __init__(self, window=10.0):
+        self.window = window
+        self.points = deque()
+        self.regression = IncrementalRegression()
+
+    def reset(self):
+        self.points.clear()
+        self.regression.reset()
+
+    def add(self, t, co2):
+        self.points.append((t, co2))
+        self.regression.add(t, co2)
+        while self.points and t - self.points[0][0] > self.window:
+            self.regression.remove(*self.points.popleft())
+
+    def trend(self):
+        """(slope in ppm/s, r2) once the window is mostly filled, else None"""
+        if len(self.points) < 3 or self.points[-1][0] - self.points[0][0] < 0.8 * self.window:
+            return None
+        fit = self.regression.fit()
+        if fit is None:
+            return None
+        return fit[0], fit[2]
+
+
+class CollarScheduler():
+    def __init__(self, collars, close_slope=0.1, close_r2=0.8, open_slope=2.0, open_margin=10.0, window=10.0):
+        """
+        Args:
+            collars (list): Collar entries in the order they are measured
+            close_slope (float): Rise in ppm/s detected as a closed chamber
+            close_r2 (float): Minimum r2 of the rise, so noise is not taken for a closure
+            open_slope (float): Drop in ppm/s detected as an opened chamber
+            open_margin (float): Or CO2 back within this many ppm of the level before the closure,
+                once it rose more than twice that
+            window (float): Length of the trend window in s
+        """
+        self.collars = list(collars)
+        self.close_slope = close_slope
+        self.close_r2 = close_r2
+        self.open_slope = open_slope
+        self.open_margin = open_margin
+        self.detector = TrendDetector(window)
+        self.index = 0
+        self.state = DONE
+        self.baseline = None
+        self.peak = None
+        self.timing = None
+        self.timings = []
+        self.last_opened = None
+
+    @property
+    def current(self):
+        return self.collars[self.index] if self.index < len(self.collars) else None
+
+    def start(self, t=None):
+        """Arm the first collar, returns the actions to apply"""
+        self.index = 0
+        self.timings = []
+        self.last_opened = None
+        if not self.collars:
+            self.state = DONE
+            return [("done", None)]
+        return self._arm(t if t is not None else time.time())
+
+    def stop(self):
+        """Abort the survey, returns the actions to apply"""
+        actions = [("stop", self.current)] if self.state == RECORDING else []
+        self.state = DONE
+        return actions
+
+    def update(self, t, co2):
+        """Feed a live sample, returns the list of (action, collar) to apply: arm, start, stop or done"""
+        if self.state == DONE or co2 is None:
+            return []
+        self.detector.add(t, co2)
+        if self.peak is not None:
+            self.peak = max(self.peak, co2)
+        trend = self.detector.trend()
+        collar = self.current
+        if self.state == WAIT_CLOSE:
+            if trend is not None and trend[0] >= self.close_slope and trend[1] >= self.close_r2:
+                # The level before the rise, to recognize the opening
+                self.baseline = self.peak = min(co2 for _, co2 in self.detector.points)
+                self.timing["closed"] = t
+                self.state = RECORDING
+                self.detector.reset()
+                return [("start", collar)]
+        elif self.state == RECORDING:
+            if self._opened(trend, co2):
+                # Opened before the end of the duration, the collar is measured again
+                print(f"{collar.name}: chamber opened after {t - self.timing['closed']:.0f} s, "
+                      f"before the {collar.duration:.0f} s duration, measuring it again")
+                self.timing["opened"] = t
+                self.last_opened = t
+                return [("stop", collar)] + self._arm(t)
+            if t - self.timing["closed"] >= collar.duration:
+                self.timing["stopped"] = t
+                self.state = WAIT_OPEN
+                return [("stop", collar)]
+        elif self.state == WAIT_OPEN:
+            if self._opened(trend, co2):
+                self.timing["opened"] = t
+                self.last_opened = t
+                self._log_timing(collar)
+                self.index += 1
+                if self.index >= len(self.collars):
+                    self.state = DONE
+                    return [("done", None)]
+                return self._arm(t)
+        return []
+
+    def _opened(self, trend, co2):
+        if trend is not None and trend[0] <= -self.open_slope:
+            return True
+        if self.baseline is None or self.peak < self.baseline + 2 * self.open_margin:
+            return False
+        return co2 <= self.baseline + self.open_margin
+
+    def _arm(self, t):
+        self.state = WAIT_CLOSE
+        self.baseline = self.peak = None
+        self.detector.reset()
+        self.timing = {"armed": t, "previous_opened": self.last_opened}
+        return [("arm", self.current)]
+
+    def _log_timing(self, collar):
+        timing = self.timing
+        entry = {"collar": collar.name,
+                 "wait": timing["closed"] - timing["armed"],
+                 "recorded": timing["stopped"] - timing["closed"],
+                 "open_delay": timing["opened"] - timing["stopped"],
+                 "turnaround": (timing["closed"] - timing["previous_opened"]
+                                if timing["previous_opened"] is not None else None)}
+        self.timings.append(entry)
+        turnaround = f", turnaround {entry['turnaround']:.0f} s" if entry["turnaround"] is not None else ""
+        print(f"{collar.name}: closed after {entry['wait']:.0f} s, recorded {entry['recorded']:.0f} s, "
+              f"opened {entry['open_delay']:.0f} s after the end{turnaround}")
+
+    def stats(self):
+        """Mean timings of the collars measured so far"""
+        if not self.timings:
+            return None
+        turnarounds = [entry["turnaround"] for entry in self.timings if entry["turnaround"] is not None]
+        return {"collars": len(self.timings), "remaining": max(0, len(self.collars) - self.index),
+                "mean_recorded": sum(entry["recorded"] for entry in self.timings) / len(self.timings),
+                "mean_turnaround": sum(turnarounds) / len(turnarounds) if turnarounds else None}
@@ -0,0 +1,89 @@
+"""
+Event driven framing of the Li-850 serial stream.
+The reader blocks on read_until(b'\\n') instead of polling in_waiting, so a frame
+is handed over as soon as its last byte arrives. Frames are kept as bytes and
+only decoded by the parser.
+"""
+
+import time
+
+
+class LatencyStats():
+    """Running statistics of a latency in seconds"""
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.last = None
+        self.mean = None
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.last = value
+        self.mean = value if self.mean is None else self.mean + self.smoothing * (value - self.mean)
+        if value > self.max:
+            self.max = value
+
+    def stats(self):
+        return {"count": self.count, "last": self.last, "mean": self.mean, "max": self.max}
+
+
+class FrameReader():
+    def __init__(self, serial_connection, terminator=b'\n', max_frame_size=4096):
+        self.serial_connection = serial_connection
+        self.terminator = terminator
+        self.max_frame_size = max_frame_size
+        self.latency = LatencyStats()
+        self._pending = bytearray()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.frames = 0
+        self.partial_frames = 0
+        self.dropped_frames = 0
+        self.bytes_read = 0
+        self.latency.reset()
+
+    def reset(self):
+        """Forget any half received frame, used after flushing the serial input"""
+        if self._pending:
+            self.dropped_frames += 1
+        self._pending.clear()
+
+    def read_frame(self):
+        """
+        Block until a complete line is received or the serial timeout expires.
+
+        Returns:
+            tuple: (frame bytes, arrival time from time.monotonic) or None on timeout
+        """
+        chunk = self.serial_connection.read_until(self.terminator, self.max_frame_size)
+        if not chunk:
+            return None
+        arrival = time.monotonic()
+        self.bytes_read += len(chunk)
+        if not chunk.endswith(self.terminator):
+            # Timeout in the middle of a frame, keep the bytes for the next read
+            self._pending += chunk
+            if len(self._pending) > self.max_frame_size:
+                self.dropped_frames += 1
+                self._pending.clear()
+            return None
+        if self._pending:
+            chunk = bytes(self._pending) + chunk
+            self._pending.clear()
+        frame = chunk.strip()
+        if not frame:
+            return None
+        self.frames += 1
+        if not (frame.startswith(b"<li850>") and frame.endswith(b"</li850>")):
+            self.partial_frames += 1
+        return frame, arrival
+
+    def stats(self):
+        return {"frames": self.frames, "partial_frames": self.partial_frames,
+                "dropped_frames": self.dropped_frames, "bytes_read": self.bytes_read,
+                "latency": self.latency.stats()}
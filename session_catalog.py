@@ -0,0 +1,216 @@
+"""
+SQLite catalog of the measurement sessions stored in the data directory.
+A session is added when a measurement is stopped, and the existing files are
+indexed at startup by backfill(), which summarizes new or modified files in
+parallel and skips the ones whose size and modification time did not change.
+The web interface already runs threads when it starts, so it runs the backfill
+in a process of its own: python session_catalog.py data
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from flux import FluxEngine
+from session_store import SessionReader, EXTENSION
+
+# Header entries of a .li850 session given to FluxEngine
+CHAMBER_SETTINGS = ("volume", "area", "dead_band")
+DATE_SUFFIX = re.compile(r"_(\d{4})_(\d{2})_(\d{2})_(\d{2})_(\d{2})$")
+
+FIELDS = ["path", "collar", "user", "start_time", "end_time", "samples", "co2_min", "co2_max",
+          "flux", "r2", "size", "mtime"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    path TEXT PRIMARY KEY,
+    collar TEXT,
+    user TEXT,
+    start_time REAL,
+    end_time REAL,
+    samples INTEGER,
+    co2_min REAL,
+    co2_max REAL,
+    flux REAL,
+    r2 REAL,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_collar ON sessions (collar, start_time);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user, start_time);
+"""
+
+
+def split_filename(path):
+    """Collar name and start time (epoch) from <collar>_YYYY_MM_DD_HH_MM.<ext>"""
+    base = os.path.splitext(os.path.basename(path))[0]
+    match = DATE_SUFFIX.search(base)
+    if match is None:
+        return base, None
+    start = datetime(*(int(g) for g in match.groups())).timestamp()
+    return base[:match.start()], start
+
+
+def summarize_file(path):
+    """
+    Catalog entry of a session file, .li850 or csv as written by the previous versions.
+    The flux uses the chamber settings of the session header, the defaults for csv files.
+    """
+    collar, start_time = split_filename(path)
+    flux = FluxEngine()
+    co2_min = co2_max = None
+    samples = 0
+    last_elapsed = None
+    user = None
+    if path.endswith(EXTENSION):
+        with SessionReader(path) as session:
+            user = session.header.get("user")
+            start_time = session.header.get("start_time", start_time)
+            flux = FluxEngine(**{name: session.header[name] for name in CHAMBER_SETTINGS
+                                 if session.header.get(name) is not None})
+            columns = session.columns
+            rows = session.iter_rows()
+            for row in rows:
+                values = dict(zip(columns, row))
+                samples, last_elapsed, co2_min, co2_max = _add(flux, values, samples, co2_min, co2_max)
+            del rows
+    else:
+        with open(path, "r", newline="") as f:
+            for values in csv.DictReader(f):
+                user = values.get("user", user)
+                try:
+                    values = {key: float(value) if value else None for key, value in values.items() if key != "user"}
+                except ValueError:
+                    continue
+                samples, last_elapsed, co2_min, co2_max = _add(flux, values, samples, co2_min, co2_max)
+    result = flux.result() or {}
+    stat = os.stat(path)
+    return {"path": path, "collar": collar, "user": user, "start_time": start_time,
+            "end_time": start_time + last_elapsed if start_time is not None and last_elapsed is not None else None,
+            "samples": samples, "co2_min": co2_min, "co2_max": co2_max,
+            "flux": result.get("flux"), "r2": result.get("r2"), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _add(flux, values, samples, co2_min, co2_max):
+    co2 = values.get("CO2_ppm")
+    elapsed = values.get("elapsed_time")
+    if co2 is None or elapsed is None or co2 != co2:
+        return samples, elapsed, co2_min, co2_max
+    flux.add(elapsed, co2, values.get("Cell_pressure"), values.get("Cell_temp"))
+    co2_min = co2 if co2_min is None else min(co2_min, co2)
+    co2_max = co2 if co2_max is None else max(co2_max, co2)
+    return samples + 1, elapsed, co2_min, co2_max
+
+
+def process_pool_context():
+    """fork where the platform has it, spawn on Windows. Only safe in a process that did not start threads yet"""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+class SessionCatalog():
+    def __init__(self, path="data/sessions.sqlite"):
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short lived connection per call so the catalog can be used from any thread
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def add(self, entry):
+        entry = dict(entry)
+        if "size" not in entry or "mtime" not in entry:
+            stat = os.stat(entry["path"])
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+        with self._connect() as db:
+            db.execute(f"INSERT OR REPLACE INTO sessions ({', '.join(FIELDS)}) "
+                       f"VALUES ({', '.join('?' for _ in FIELDS)})", [entry.get(field) for field in FIELDS])
+
+    def backfill(self, data_dir="data", workers=None):
+        """Index the session files that are new or changed since they were cataloged, returns their number"""
+        with self._connect() as db:
+            known = {path: (size, mtime) for path, size, mtime in db.execute("SELECT path, size, mtime FROM sessions")}
+        to_index = []
+        for path in self.session_files(data_dir):
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime):
+                to_index.append(path)
+        if not to_index:
+            return 0
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as pool:
+            for path, entry in zip(to_index, pool.map(_safe_summarize, to_index)):
+                if entry is not None:
+                    self.add(entry)
+        print(f"Indexed {len(to_index)} sessions in {time.monotonic() - start:.1f} s")
+        return len(to_index)
+
+    def backfill_in_subprocess(self, data_dir="data", workers=None):
+        """Run backfill() in a new process, for callers that already run threads like the web interface"""
+        command = [sys.executable, os.path.abspath(__file__), "--catalog", self.path, data_dir]
+        if workers:
+            command += ["--workers", str(workers)]
+        return subprocess.run(command).returncode == 0
+
+    @staticmethod
+    def session_files(data_dir):
+        """Session files, the csv exported next to a .li850 session are not sessions of their own"""
+        names = set(os.listdir(data_dir)) if os.path.isdir(data_dir) else set()
+        for name in sorted(names):
+            base, ext = os.path.splitext(name)
+            if ext == EXTENSION or (ext == ".csv" and base + EXTENSION not in names):
+                yield os.path.join(data_dir, name)
+
+    def query(self, collar=None, user=None, since=None, until=None, limit=500):
+        """Sessions matching all the given filters, most recent first, as dicts"""
+        conditions, parameters = [], []
+        for clause, value in (("collar = ?", collar), ("user = ?", user),
+                              ("start_time >= ?", since), ("start_time <= ?", until)):
+            if value is not None and value != "":
+                conditions.append(clause)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute(f"SELECT * FROM sessions {where} ORDER BY start_time DESC LIMIT ?",
+                              parameters + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+
+def _safe_summarize(path):
+    try:
+        return summarize_file(path)
+    except Exception as e:
+        print(f"Unable to index {path}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the session files in the catalog")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("--catalog", default=None, help="catalog file (default: <data_dir>/sessions.sqlite)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    catalog = SessionCatalog(args.catalog or os.path.join(args.data_dir, "sessions.sqlite"))
+    catalog.backfill(args.data_dir, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
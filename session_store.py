@@ -0,0 +1,117 @@
+"""
+Compact binary session files, the primary on-disk store of a measurement.
+Layout of a .li850 file:
+    b"LI850SES" | uint32 header length | JSON header (columns, user, start time...) padded to 8 bytes
+    then one little-endian float64 per column for each record, appended as samples arrive.
+The record count is derived from the file size, a record cut by a power loss is ignored.
+CSV is only generated from this file when it is downloaded.
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+
+from recorder import Recorder, format_csv_row
+
+MAGIC = b"LI850SES"
+VERSION = 1
+EXTENSION = ".li850"
+_LENGTH = struct.Struct("<I")
+
+
+class SessionWriter(Recorder):
+    """Fixed width binary records, the header and the file size describe the whole session"""
+    def __init__(self, columns, fsync_rows=10, fsync_interval=5.0):
+        super().__init__(columns, fsync_rows=fsync_rows, fsync_interval=fsync_interval)
+        self._record = struct.Struct("<" + "d" * len(self.columns))
+
+    def _header(self):
+        header = dict(self.metadata)
+        header.update({"version": VERSION, "columns": self.columns, "format": "<f8"})
+        data = json.dumps(header).encode('utf-8')
+        # Records start on an 8 bytes boundary so the file can be mapped as float64
+        data += b" " * (-(len(MAGIC) + _LENGTH.size + len(data)) % 8)
+        return MAGIC + _LENGTH.pack(len(data)) + data
+
+    def _row(self, values):
+        return self._record.pack(*(math.nan if v is None else v for v in values))
+
+
+class SessionReader():
+    """Memory mapped access to a session file"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a Li-850 session file")
+            header_length = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+            self.header = json.loads(f.read(header_length))
+            self.offset = len(MAGIC) + _LENGTH.size + header_length
+            size = os.fstat(f.fileno()).st_size
+            self.columns = self.header["columns"]
+            self._record = struct.Struct("<" + "d" * len(self.columns))
+            self.length = (size - self.offset) // self._record.size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def records(self):
+        """Zero-copy view of the records as a (rows, columns) float64 memoryview"""
+        end = self.offset + self.length * self._record.size
+        return memoryview(self._mmap)[self.offset:end].cast("d", shape=[self.length, len(self.columns)])
+
+    def iter_rows(self):
+        end = self.offset + self.length * self._record.size
+        return self._record.iter_unpack(memoryview(self._mmap)[self.offset:end])
+
+    def column(self, name):
+        index = self.columns.index(name)
+        return [row[index] for row in self.iter_rows()]
+
+    def to_numpy(self):
+        """Structured numpy array mapped on the file, without copy"""
+        import numpy as np
+        dtype = np.dtype([(name, "<f8") for name in self.columns])
+        return np.frombuffer(self._mmap, dtype=dtype, count=self.length, offset=self.offset)
+
+
+def file_hash(path):
+    """sha256 of the file content, identifies a session whatever its name or mtime"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(256 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_csv(session_path, csv_path=None, index_label="rcrd_nb"):
+    """
+    Stream a session file into a CSV with the columns of the previous csv files.
+    The CSV is kept next to the session and only rebuilt if the session is newer.
+    """
+    if csv_path is None:
+        csv_path = os.path.splitext(session_path)[0] + ".csv"
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) >= os.path.getmtime(session_path):
+        return csv_path
+    with SessionReader(session_path) as session, open(csv_path + ".tmp", "w", buffering=256 * 1024) as f:
+        user = session.header.get("user")
+        f.write(format_csv_row([index_label] + session.columns + ["user"]))
+        for i, row in enumerate(session.iter_rows()):
+            f.write(format_csv_row([i] + [None if math.isnan(v) else v for v in row] + [user]))
+    os.replace(csv_path + ".tmp", csv_path)
+    return csv_path
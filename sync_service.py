@@ -0,0 +1,256 @@
+"""
+Background upload of the completed sessions to a collection server.
+Sessions not yet on the server (deduplicated by the sha256 of their content)
+are packed in gzip compressed tar batches and uploaded in chunks over a
+kept-alive HTTP connection. An interrupted upload resumes at the offset the
+server already has. Uploads are throttled to a maximum rate and paused while
+an analyzer is recording.
+
+Protocol, relative to the endpoint url (see sync_standin_server.py):
+    POST /sessions/known        {"hashes": [...]} -> {"known": [...]}
+    HEAD /uploads/<batch hash>  -> Upload-Offset header, 404 if the upload never started
+    PUT  /uploads/<batch hash>  chunk with an Upload-Offset header -> 204 with the new Upload-Offset
+    POST /uploads/<batch hash>/complete  {"sessions": {name: hash}} -> 200 once the batch is verified
+"""
+
+import gzip
+import http.client
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from session_catalog import SessionCatalog
+from session_store import file_hash
+
+
+def build_batch(paths, out_path):
+    """Deterministic .tar.gz of the sessions so a rebuilt batch has the same hash and can resume"""
+    with open(out_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as compressed:
+            with tarfile.open(fileobj=compressed, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for path in sorted(paths):
+                    info = tar.gettarinfo(path, arcname=os.path.basename(path))
+                    info.mtime = int(os.path.getmtime(path))
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with open(path, "rb") as f:
+                        tar.addfile(info, f)
+    return file_hash(out_path)
+
+
+class TokenBucket():
+    """Limits the upload rate in bytes per second"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def consume(self, amount, stop_event):
+        """Wait until amount bytes (at most burst) can be sent, returns early if stop_event is set"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            if stop_event.wait((amount - self.tokens) / self.rate):
+                return
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncClient():
+    """Kept-alive HTTP connection to the collection server"""
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            self._connection = connection_class(self.host, timeout=self.timeout)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, headers, body), the connection is reused between requests"""
+        for attempt in range(2):
+            connection = self._connect()
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+                return response.status, response.headers, data
+            except (http.client.HTTPException, OSError):
+                # The server closed the kept-alive connection, retry once on a new one
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def post_json(self, path, payload):
+        status, _, data = self.request("POST", path, json.dumps(payload).encode('utf-8'),
+                                       {"Content-Type": "application/json"})
+        if status != 200:
+            raise SyncError(f"POST {path} returned {status}")
+        return json.loads(data) if data else {}
+
+
+class SyncService():
+    def __init__(self, url, data_dir="data", is_busy=None, active_paths=None,
+                 rate=50_000, chunk_size=64 * 1024, batch_size=4 * 1024 * 1024, interval=60.0):
+        self.url = url
+        self.data_dir = data_dir
+        self.is_busy = is_busy or (lambda: False)
+        self.active_paths = active_paths or (lambda: [])
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.bucket = TokenBucket(rate, burst=max(rate, chunk_size))
+        self.client = SyncClient(url)
+        self.state_path = os.path.join(data_dir, "sync_state.json")
+        self.state = self._load_state()
+        self.bytes_uploaded = 0
+        self.sessions_synced = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.is_busy():
+                try:
+                    self.sync_once()
+                    self.last_error = None
+                except (SyncError, OSError, http.client.HTTPException) as e:
+                    # No connectivity or server error, try again at the next interval
+                    self.last_error = str(e)
+                    self.client.close()
+            self._stop.wait(self.interval)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hashes": {}, "synced": []}
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def completed_sessions(self):
+        """Session files that are not being recorded, with their content hash (cached by size and mtime)"""
+        active = {os.path.abspath(path) for path in self.active_paths()}
+        sessions = {}
+        for path in SessionCatalog.session_files(self.data_dir):
+            if os.path.abspath(path) in active:
+                continue
+            stat = os.stat(path)
+            cached = self.state["hashes"].get(path)
+            if cached is None or cached[:2] != [stat.st_size, stat.st_mtime]:
+                cached = [stat.st_size, stat.st_mtime, file_hash(path)]
+                self.state["hashes"][path] = cached
+            sessions[path] = cached[2]
+        return sessions
+
+    def sync_once(self):
+        """Upload all the sessions the server does not have yet, returns the number of sessions sent"""
+        sessions = self.completed_sessions()
+        synced = set(self.state["synced"])
+        pending = {path: digest for path, digest in sessions.items() if digest not in synced}
+        if not pending:
+            return 0
+        known = set(self.client.post_json("/sessions/known", {"hashes": sorted(set(pending.values()))})["known"])
+        synced.update(known)
+        pending = {path: digest for path, digest in pending.items() if digest not in known}
+        sent = 0
+        for batch in self._batches(pending):
+            if self._stop.is_set() or self.is_busy():
+                break
+            self._upload_batch(batch)
+            synced.update(batch.values())
+            sent += len(batch)
+            self.state["synced"] = sorted(synced)
+            self._save_state()
+        self.state["synced"] = sorted(synced)
+        self._save_state()
+        self.sessions_synced += sent
+        return sent
+
+    def _batches(self, pending):
+        batch, size = {}, 0
+        for path in sorted(pending):
+            length = os.path.getsize(path)
+            if batch and size + length > self.batch_size:
+                yield batch
+                batch, size = {}, 0
+            batch[path] = pending[path]
+            size += length
+        if batch:
+            yield batch
+
+    def _upload_batch(self, batch):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = os.path.join(tmp_dir, "batch.tar.gz")
+            batch_hash = build_batch(list(batch), archive)
+            total = os.path.getsize(archive)
+            status, headers, _ = self.client.request("HEAD", f"/uploads/{batch_hash}")
+            offset = int(headers.get("Upload-Offset", 0)) if status == 200 else 0
+            with open(archive, "rb") as f:
+                f.seek(offset)
+                while offset < total:
+                    # Leave the bandwidth to the live acquisition, the upload resumes once it stops
+                    while self.is_busy() and not self._stop.is_set():
+                        self._stop.wait(1.0)
+                    if self._stop.is_set():
+                        raise SyncError("Sync stopped")
+                    chunk = f.read(self.chunk_size)
+                    self.bucket.consume(len(chunk), self._stop)
+                    status, headers, _ = self.client.request(
+                        "PUT", f"/uploads/{batch_hash}", chunk,
+                        {"Upload-Offset": str(offset), "Upload-Length": str(total),
+                         "Content-Type": "application/octet-stream"})
+                    if status == 409:
+                        # The server has a different offset, continue from there
+                        offset = int(headers.get("Upload-Offset", 0))
+                        f.seek(offset)
+                        continue
+                    if status != 204:
+                        raise SyncError(f"Chunk upload returned {status}")
+                    offset += len(chunk)
+                    self.bytes_uploaded += len(chunk)
+            names = {os.path.basename(path): digest for path, digest in batch.items()}
+            self.client.post_json(f"/uploads/{batch_hash}/complete", {"sessions": names, "length": total})
+        print(f"Synced {len(batch)} sessions ({total} bytes compressed)")
+
+    def stats(self):
+        return {"bytes_uploaded": self.bytes_uploaded, "sessions_synced": self.sessions_synced,
+                "last_error": self.last_error}
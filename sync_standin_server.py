@@ -0,0 +1,155 @@
+"""
+Local stand-in for the collection server, to try the session sync without the real one:
+
+    python sync_standin_server.py --port 8850 --directory received
+    LI850_SYNC_URL=http://localhost:8850 python Li-850_nicegui.py
+
+--fail-after N closes the connection after N chunks to check that the uploads resume.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CollectionStore():
+    def __init__(self, directory):
+        self.directory = directory
+        self.uploads_dir = os.path.join(directory, "uploads")
+        self.sessions_dir = os.path.join(directory, "sessions")
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_path, "r") as f:
+                self.known = json.load(f)
+        except (OSError, ValueError):
+            self.known = {}
+
+    def upload_path(self, batch_hash):
+        return os.path.join(self.uploads_dir, batch_hash + ".part")
+
+    def offset(self, batch_hash):
+        path = self.upload_path(batch_hash)
+        return os.path.getsize(path) if os.path.exists(path) else None
+
+    def append(self, batch_hash, offset, data):
+        with self.lock:
+            current = self.offset(batch_hash) or 0
+            if offset != current:
+                return False, current
+            with open(self.upload_path(batch_hash), "ab") as f:
+                f.write(data)
+            return True, current + len(data)
+
+    def complete(self, batch_hash, sessions):
+        path = self.upload_path(batch_hash)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(256 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != batch_hash:
+            os.remove(path)
+            return False
+        with tarfile.open(path, "r:gz") as tar:
+            for member in tar.getmembers():
+                if member.isfile() and os.path.basename(member.name) == member.name:
+                    with tar.extractfile(member) as src, open(os.path.join(self.sessions_dir, member.name), "wb") as dst:
+                        dst.write(src.read())
+        os.remove(path)
+        with self.lock:
+            for name, session_hash in sessions.items():
+                self.known[session_hash] = name
+            with open(self.index_path, "w") as f:
+                json.dump(self.known, f)
+        return True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+    fail_after = None
+    chunks = 0
+
+    def _reply(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _batch_hash(self):
+        parts = self.path.strip("/").split("/")
+        return parts[1] if len(parts) >= 2 and parts[0] == "uploads" and len(parts[1]) == 64 else None
+
+    def do_HEAD(self):
+        batch_hash = self._batch_hash()
+        offset = self.store.offset(batch_hash) if batch_hash else None
+        if offset is None:
+            self._reply(404)
+        else:
+            self._reply(200, headers={"Upload-Offset": offset})
+
+    def do_PUT(self):
+        batch_hash = self._batch_hash()
+        data = self._body()
+        if batch_hash is None:
+            return self._reply(404)
+        Handler.chunks += 1
+        if self.fail_after is not None and Handler.chunks > self.fail_after:
+            # Simulated interruption, the chunk is lost and the connection dropped
+            Handler.fail_after = None
+            self.close_connection = True
+            return
+        accepted, offset = self.store.append(batch_hash, int(self.headers.get("Upload-Offset", 0)), data)
+        self._reply(204 if accepted else 409, headers={"Upload-Offset": offset})
+
+    def do_POST(self):
+        payload = json.loads(self._body() or b"{}")
+        if self.path.rstrip("/") == "/sessions/known":
+            return self._reply(200, {"known": [h for h in payload.get("hashes", []) if h in self.store.known]})
+        batch_hash = self._batch_hash()
+        if batch_hash and self.path.rstrip("/").endswith("/complete") and self.store.offset(batch_hash) is not None:
+            if self.store.complete(batch_hash, payload.get("sessions", {})):
+                return self._reply(200, {"stored": len(payload.get("sessions", {}))})
+            return self._reply(422, {"error": "hash mismatch"})
+        self._reply(404)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the session collection server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8850)
+    parser.add_argument("--directory", default="received", help="Where the uploaded sessions are stored")
+    parser.add_argument("--fail-after", type=int, default=None, help="Drop the connection after N chunks, once")
+    args = parser.parse_args()
+    Handler.store = CollectionStore(args.directory)
+    Handler.fail_after = args.fail_after
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Collection stand-in listening on http://{args.host}:{args.port}, storing in {args.directory}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()